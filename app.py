@@ -6,33 +6,228 @@ Versión corregida y completa de app.py
 - Mantiene la estructura y endpoints originales del proyecto.
 """
 
+import hashlib
+import hmac
+import logging
 import os
+import re
 import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from functools import lru_cache
+from itertools import count, groupby
+from operator import itemgetter
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import click
 from dotenv import load_dotenv
 from flask import (
     Flask, render_template, request, jsonify, redirect, url_for,
-    session, flash, g
+    session, flash, g, has_app_context, Response, stream_template, make_response
 )
+from flask_caching import Cache
+from flask.json.provider import DefaultJSONProvider
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# argon2-cffi (opcional) para hashes argon2id
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+except ImportError:
+    PasswordHasher = None
+
+# orjson (opcional) serializa en C las respuestas JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# gevent (opcional): solo presente con el worker de wsgi.py
+try:
+    from gevent import get_hub
+    from gevent.monkey import is_module_patched
+except ImportError:
+    get_hub = None
+
 # carga .env
 load_dotenv()
 
+# logging con nivel configurable (LOG_LEVEL); app.logger en vez de print()
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 app = Flask(__name__)
 app.secret_key = os.getenv("SECRET_KEY", "supersecretkey")
 app.config['SESSION_PERMANENT'] = False
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    jsonify/app.json con orjson. Lo que orjson no conoce (Decimal de los
+    ROUND de Postgres, etc.) pasa por el default de Flask.
+    """
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        # el serializador de la sesión pasa object_hook (decodifica los valores
+        # etiquetados, p. ej. las tuplas de flash): eso solo lo hace json
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+
+# Caché: SimpleCache por proceso; con varios workers usar RedisCache (CACHE_TYPE / CACHE_REDIS_URL)
+cache = Cache(app, config={
+    'CACHE_TYPE': os.getenv("CACHE_TYPE", "SimpleCache"),
+    'CACHE_REDIS_URL': os.getenv("CACHE_REDIS_URL"),
+    'CACHE_DEFAULT_TIMEOUT': 300,
+})
+
+# Tablas de usuarios por tipo y roles permitidos (constantes del módulo)
+TABLA_POR_TIPO = MappingProxyType({'docente': 'maestros', 'administrativo': 'administrativos'})
+ROLES_ADMIN_O_DOCENTE = frozenset({'docente', 'admin'})
+ROLES_CON_SESION = frozenset({'admin', 'docente', 'estudiante'})
+
+# Algoritmo de hash de contraseñas. argon2id (argon2-cffi) por defecto; con
+# cualquier otro valor se usa werkzeug, p. ej. PW_METHOD=scrypt o
+# PW_METHOD=pbkdf2:sha256:120000. Los hashes antiguos de werkzeug se siguen
+# verificando.
+PW_METHOD = os.getenv('PW_METHOD', 'argon2')
+
+# SQL de las tablas de usuarios, generado una sola vez por tabla.
+# Solo existen claves para tablas de TABLA_POR_TIPO: nada de f-strings por petición.
+_PLANTILLAS_USUARIOS = {
+    'sel_by_usuario': "SELECT id, usuario, contrasena FROM {t} WHERE usuario = %s",
+    'sel_by_id': "SELECT id, usuario FROM {t} WHERE id = %s",
+    # RETURNING vacío = el usuario ya existía (UNIQUE); mismo SQL en Postgres y SQLite
+    'insert': "INSERT INTO {t} (usuario, contrasena) VALUES (%s, %s) ON CONFLICT (usuario) DO NOTHING RETURNING id",
+    'delete': "DELETE FROM {t} WHERE id = %s",
+    'update_with_pw': "UPDATE {t} SET usuario = %s, contrasena = %s WHERE id = %s",
+    'update_no_pw': "UPDATE {t} SET usuario = %s WHERE id = %s",
+    'update_pw': "UPDATE {t} SET contrasena = %s WHERE id = %s",
+    'sel_pw_by_id': "SELECT contrasena FROM {t} WHERE id = %s",
+}
+QUERIES = MappingProxyType({
+    (nombre, tabla): plantilla.format(t=tabla)
+    for nombre, plantilla in _PLANTILLAS_USUARIOS.items()
+    for tabla in TABLA_POR_TIPO.values()
+})
+
+# Listado de docentes y admins en un solo round-trip (ver_usuarios).
+# Paginación por keyset sobre usuario (UNIQUE, con índice): cada tabla
+# continúa desde el último usuario mostrado, sin OFFSET ni fetchall de todo.
+USUARIOS_POR_PAGINA = 50
+USUARIOS_POR_TIPO_SQL = """
+    SELECT tipo, id, usuario FROM (
+        SELECT 'docente' AS tipo, id, usuario FROM maestros
+        WHERE usuario > %s ORDER BY usuario LIMIT %s
+    ) d
+    UNION ALL
+    SELECT tipo, id, usuario FROM (
+        SELECT 'administrativo' AS tipo, id, usuario FROM administrativos
+        WHERE usuario > %s ORDER BY usuario LIMIT %s
+    ) a
+    ORDER BY tipo, usuario
+"""
+
 # ---------------------------
 # Conexión a DB + helper db_query
 # ---------------------------
+# putconn() cierra las conexiones que sobran por encima de DB_POOL_MIN: debe
+# cubrir la concurrencia real de cada worker (hilos de gunicorn + 2 hilos del
+# prefetch de /calificaciones) o se vuelve a abrir una conexión por petición
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 3))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 20))
+# ThreadedConnectionPool lanza PoolError en cuanto se agota; con el semáforo
+# una petición espera hasta DB_POOL_TIMEOUT segundos a que se libere una
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 5))
+_pool_libres = threading.BoundedSemaphore(DB_POOL_MAX)
+# una conexión devuelta al pool hace menos de DB_PING_IDLE segundos se entrega
+# sin SELECT 1; las que estuvieron más tiempo quietas se comprueban antes
+DB_PING_IDLE = float(os.getenv("DB_PING_IDLE", 30))
+
+_pool = None
+_pool_lock = threading.Lock()
+_sqlite_local = threading.local()
+
+class _ConexionPg(psycopg2.extensions.connection):
+    """
+    Conexión del pool que recuerda qué sentencias ya preparó (PREPARE) y
+    cuándo se devolvió al pool por última vez (ultimo_uso, time.monotonic()).
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.preparadas = set()
+        self.ultimo_uso = time.monotonic()
+
+def _conexion_viva(conn):
+    """
+    Descarta sin ir al servidor las conexiones cerradas o en estado
+    desconocido (socket roto). Solo las que llevan más de DB_PING_IDLE
+    segundos en el pool se comprueban con un SELECT 1: si el servidor las
+    cortó mientras tanto, psycopg2 sigue con closed == 0 hasta que una
+    consulta falla. Las de uso reciente se entregan sin ida y vuelta extra.
+    """
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if time.monotonic() - conn.ultimo_uso < DB_PING_IDLE:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+def _get_pool(dsn):
+    """
+    Devuelve el pool de conexiones a Postgres del proceso.
+    Se crea una sola vez (protegido con lock para workers con hilos).
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = psycopg2.pool.ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, dsn,
+                    connection_factory=_ConexionPg,
+                    cursor_factory=psycopg2.extras.RealDictCursor
+                )
+    return _pool
+
+@lru_cache(maxsize=256)
+def _nombres_columnas(description):
+    return tuple(col[0] for col in description)
+
+def _dict_factory(cur, row):
+    # SQLite devuelve dicts directamente, igual que RealDictCursor en Postgres:
+    # db_query siempre entrega dicts (salvo tuples=True / write_only=True).
+    # Se llama por fila: los nombres de columna salen de una caché por
+    # description en vez de rearmar la lista en cada fila
+    return dict(zip(_nombres_columnas(cur.description), row))
+
 def get_db_connection():
     """
-    Devuelve una conexión a Postgres si DATABASE_URL existe,
-    si no, devuelve conexión sqlite3.
+    Devuelve una conexión del pool de Postgres si DATABASE_URL existe,
+    si no, la conexión sqlite3 del hilo actual (se reutiliza entre peticiones).
+    Con DATABASE_URL puesto nunca cae a SQLite: si Postgres no responde el
+    error sube y base_no_disponible lo convierte en un 503 (escribir en el
+    database.db local dejaría esos datos fuera de la base real).
+    Las conexiones se devuelven con release_db_connection(conn).
     NO modifica atributos internos de la conexión (evita _flavor).
     """
     dsn = os.getenv("DATABASE_URL")
@@ -40,205 +235,800 @@ def get_db_connection():
         # render y otros providers a veces usan postgres:// -> psycopg2 espera postgresql://
         if dsn.startswith("postgres://"):
             dsn = dsn.replace("postgres://", "postgresql://", 1)
+        if not _pool_libres.acquire(timeout=DB_POOL_TIMEOUT):
+            # pool agotado (DB_POOL_MAX): no es un fallo de conexión,
+            # no hay que mandar la petición a la base SQLite local
+            raise psycopg2.pool.PoolError("connection pool exhausted")
         try:
-            conn = psycopg2.connect(dsn, cursor_factory=psycopg2.extras.RealDictCursor)
-            # No establecer atributos custom en la conexión
+            pool = _get_pool(dsn)
+            conn = pool.getconn()
+            if not _conexion_viva(conn):
+                # conexión caída mientras estaba en el pool (reinicio de la base,
+                # pg_terminate_backend, timeout del proxy): se descarta y se abre otra
+                pool.putconn(conn, close=True)
+                conn = pool.getconn()
             return conn
+        except psycopg2.pool.PoolError:
+            _pool_libres.release()
+            raise
         except Exception as e:
-            print("❌ Error conectando a PostgreSQL, fallback SQLite:", e)
+            _pool_libres.release()
+            app.logger.error("❌ Error conectando a PostgreSQL: %s", e)
+            raise
 
-    # fallback a sqlite
+    # sin DATABASE_URL, sqlite: una conexión por hilo, abierta una sola vez
+    conn = getattr(_sqlite_local, "conn", None)
+    if conn is not None:
+        return conn
     try:
-        conn = sqlite3.connect("database.db", check_same_thread=False)
-        conn.row_factory = sqlite3.Row
+        # caché de sentencias preparadas más grande que el default (128): las
+        # constantes *_SQL ya adaptadas por _to_sqlite no se vuelven a compilar
+        conn = sqlite3.connect("database.db", check_same_thread=False, cached_statements=256)
+        conn.row_factory = _dict_factory
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conn.execute("PRAGMA mmap_size=268435456")
+        # conexión de larga vida: refrescar estadísticas (ANALYZE) de las tablas
+        # que lo necesiten para que el planificador use los índices de DDL_INDICES
+        conn.execute("PRAGMA optimize=0x10002")
+        _sqlite_local.conn = conn
         return conn
-    except Exception as e:
-        print("❌ Error conectando a SQLite:", e)
+    except Exception:
+        app.logger.exception("❌ Error conectando a SQLite")
         raise
 
+@app.errorhandler(psycopg2.OperationalError)
+@app.errorhandler(psycopg2.pool.PoolError)
+def base_no_disponible(e):
+    # Postgres caído o pool agotado: es temporal, el cliente puede reintentar
+    app.logger.error("❌ Base de datos no disponible: %s", e)
+    return "Base de datos no disponible, intenta de nuevo en unos segundos.", 503, {'Retry-After': '5'}
+
+def release_db_connection(conn):
+    """
+    Devuelve la conexión al pool (Postgres). La de SQLite se queda abierta
+    para el hilo; solo se deshace lo que haya quedado sin commit.
+    """
+    if _is_sqlite_conn(conn):
+        if conn.in_transaction:
+            conn.rollback()
+        return
+    if _pool is None:
+        conn.close()
+        return
+    # putconn hace rollback de transacciones abiertas antes de reutilizarla;
+    # las conexiones ya cerradas/rotas se descartan en vez de volver al pool
+    conn.ultimo_uso = time.monotonic()
+    try:
+        try:
+            _pool.putconn(conn, close=bool(conn.closed))
+        except Exception:
+            # el rollback falló (socket roto): sin esto la conexión quedaría
+            # marcada como en uso y el pool perdería ese hueco para siempre
+            _pool.putconn(conn, close=True)
+    finally:
+        _pool_libres.release()
+
 def _is_sqlite_conn(conn):
     return isinstance(conn, sqlite3.Connection)
 
-def db_query(query, params=None, one=False, commit=False):
-    conn = get_db_connection()
+@lru_cache(maxsize=512)
+def _to_sqlite(query):
+    # Adaptar placeholders: %s (Postgres) → ? (SQLite); se cachea por consulta
+    return query.replace("%s", "?")
 
-    # Detectar si la conexión es SQLite
-    is_sqlite = isinstance(conn, sqlite3.Connection)
+def _db():
+    """
+    Conexión de la petición/contexto actual. Se obtiene del pool solo la
+    primera vez que se necesita; las rutas sin SQL no tocan el pool.
+    """
+    conn = getattr(g, "db_conn", None)
+    if conn is None:
+        conn = g.db_conn = get_db_connection()
+    return conn
 
-    # Adaptar placeholders: %s (Postgres) → ? (SQLite)
-    if is_sqlite:
-        query_sqlite = query.replace("%s", "?")
+def _cursor(conn, tipo, owns):
+    """
+    Cursor para db_query: 'dict' (RealDictCursor / filas dict en SQLite) o
+    'tuplas' (cursor simple). Dentro de una petición se reutiliza uno por
+    tipo desde g._cursores y se cierra en teardown; fuera de una petición
+    es un cursor nuevo que cierra quien lo pide.
+    """
+    if not owns:
+        cursores = g.setdefault('_cursores', {})
+        cur = cursores.get(tipo)
+        if cur is not None:
+            return cur
+    if _is_sqlite_conn(conn):
         cur = conn.cursor()
-        cur.execute(query_sqlite, params or [])
+        if tipo == 'tuplas':
+            cur.row_factory = None
     else:
-        cur = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cur.execute(query, params)
+        factory = psycopg2.extras.RealDictCursor if tipo == 'dict' else psycopg2.extensions.cursor
+        cur = conn.cursor(cursor_factory=factory)
+    if not owns:
+        cursores[tipo] = cur
+    return cur
+
+def db_query(query, params=None, one=False, commit=False, tuples=False, write_only=False,
+             many_params=None):
+    """
+    Ejecuta una consulta usando la conexión de la petición (_db()).
+    Fuera de una petición (p. ej. inicialización) abre una conexión propia
+    y la libera al terminar.
+    Con tuples=True devuelve tuplas simples (acceso por posición) en vez de
+    dicts, para bucles calientes que recorren muchas filas.
+    Con write_only=True (INSERT/UPDATE/DELETE sin RETURNING) usa un cursor
+    simple, no lee filas y devuelve el número de filas afectadas.
+    Con many_params (lista de tuplas) hace una carga masiva: el query lleva
+    "VALUES %s" y en Postgres va con execute_values (lotes de 1000 filas por
+    sentencia, no una ida y vuelta por fila); en SQLite ese %s se expande a
+    una fila de placeholders y va con executemany. Devuelve True. Es el
+    camino para cualquier alta de varias calificaciones/alumnos a la vez.
+    """
+    owns = not has_app_context()
+    conn = get_db_connection() if owns else _db()
+    if app.debug and not owns:
+        g._n_consultas = g.get('_n_consultas', 0) + 1
 
-    # ¿Commit?
-    if commit:
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
+    # Detectar si la conexión es SQLite
+    is_sqlite = _is_sqlite_conn(conn)
+
+    try:
+        cur = _cursor(conn, 'tuplas' if tuples or write_only or many_params else 'dict', owns)
+        if many_params:
+            if is_sqlite:
+                fila = "(" + ", ".join(["%s"] * len(many_params[0])) + ")"
+                cur.executemany(_to_sqlite(query.replace("VALUES %s", "VALUES " + fila)),
+                                many_params)
+            else:
+                psycopg2.extras.execute_values(cur, query, many_params, page_size=1000)
+        # SQLite: placeholders ?
+        elif is_sqlite:
+            cur.execute(_to_sqlite(query), params or [])
+        else:
+            cur.execute(query, params)
+
+        # Obtener resultados (también de INSERT/UPDATE ... RETURNING)
+        if many_params:
+            rows = None
+        elif write_only:
+            rows = cur.rowcount
+        else:
+            rows = cur.fetchall() if cur.description is not None else None
 
-    # Obtener resultados
-    rows = cur.fetchall()
-    cur.close()
-    conn.close()
+        if commit:
+            conn.commit()
+        if owns:
+            cur.close()
+    except Exception:
+        # la conexión se comparte en la petición: no dejarla en una transacción abortada
+        conn.rollback()
+        raise
+    finally:
+        if owns:
+            release_db_connection(conn)
 
-    # Postgres devuelve dict; SQLite devuelve sqlite3.Row
-    # Convertimos sqlite3.Row a dict para mantener consistencia
-    if is_sqlite:
-        rows = [dict(row) for row in rows]
+    if rows is None:
+        return True
+    if write_only:
+        return rows
 
     return rows[0] if one and rows else rows
 
+@lru_cache(maxsize=64)
+def _a_posicional(query):
+    # "%s" → "$1", "$2", ... (sintaxis de PREPARE en Postgres)
+    partes = query.split("%s")
+    return partes[0] + "".join(f"${i}{p}" for i, p in enumerate(partes[1:], 1))
+
+@lru_cache(maxsize=None)
+def _nombre_preparada(query):
+    # nombre estable por texto de SQL: la misma plantilla reusa su PREPARE
+    return "p" + hashlib.md5(query.encode()).hexdigest()[:12]
+
+def db_query_preparada(query, params, nombre=None, **kwargs):
+    """
+    db_query para consultas calientes: en Postgres la sentencia se prepara
+    una vez por conexión del pool (PREPARE) y después solo se hace EXECUTE,
+    sin volver a planearla en cada petición. Sin nombre se deriva uno del
+    texto del SQL. En SQLite (o fuera de una petición) es un db_query
+    normal; sqlite3 ya cachea las sentencias compiladas.
+    """
+    if not has_app_context():
+        return db_query(query, params, **kwargs)
+    conn = _db()
+    if _is_sqlite_conn(conn):
+        return db_query(query, params, **kwargs)
+    nombre = nombre or _nombre_preparada(query)
+    if nombre not in conn.preparadas:
+        db_query(f"PREPARE {nombre} AS {_a_posicional(query)}")
+        conn.preparadas.add(nombre)
+    marcadores = ", ".join(["%s"] * len(params))
+    return db_query(f"EXECUTE {nombre} ({marcadores})", params, **kwargs)
+
+_nombres_cursor = count()
+
+def db_query_iter(query, params=None, itersize=1000):
+    """
+    Generador de filas (dicts) para listados grandes que se envían con
+    stream_template: nunca hace fetchall(). En Postgres usa un cursor del
+    lado del servidor que trae itersize filas por viaje; en SQLite recorre
+    el cursor. Solo dentro de una petición (usa la conexión de _db()).
+    """
+    conn = _db()
+    if _is_sqlite_conn(conn):
+        cur = conn.cursor()
+        cur.execute(_to_sqlite(query), params or [])
+    else:
+        cur = conn.cursor(name=f"iter_{next(_nombres_cursor)}",
+                          cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.itersize = itersize
+        cur.execute(query, params)
+    try:
+        yield from cur
+    finally:
+        cur.close()
+
+def db_transaction(sentencias):
+    """
+    Ejecuta varias sentencias (sql, params) en una sola transacción
+    con un único commit. Si alguna falla se deshace todo.
+    """
+    owns = not has_app_context()
+    conn = get_db_connection() if owns else _db()
+    is_sqlite = _is_sqlite_conn(conn)
+    try:
+        cur = conn.cursor()
+        for query, params in sentencias:
+            if is_sqlite:
+                cur.execute(_to_sqlite(query), params or [])
+            else:
+                cur.execute(query, params)
+        conn.commit()
+        cur.close()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if owns:
+            release_db_connection(conn)
+    return True
+
 # ---------------------------
 # BEFORE / TEARDOWN
 # ---------------------------
-@app.before_request
-def before_request():
-    # create/attach a db connection to g
-    try:
-        g.db_conn = get_db_connection()
-    except Exception as e:
-        print("Error al abrir conexión:", e)
-        return "Error conectando a la base de datos", 500
-
-@app.teardown_request
-def teardown_request(exception):
-    conn = getattr(g, "db_conn", None)
+# Detector de N+1 en desarrollo (FLASK_DEBUG=1): db_query cuenta las consultas
+# de cada petición y se avisa de las rutas que pasan de N_CONSULTAS_MAX
+# (p. ej. un SELECT/DELETE por fila dentro de un bucle)
+N_CONSULTAS_MAX = int(os.getenv("N_CONSULTAS_MAX", 10))
+
+@app.after_request
+def avisar_n_mas_uno(response):
+    if app.debug:
+        n = g.get('_n_consultas', 0)
+        if n > N_CONSULTAS_MAX:
+            app.logger.warning("⚠️ %s %s: %d consultas en una petición (¿N+1?)",
+                               request.method, request.path, n)
+    return response
+
+# La conexión se toma de forma perezosa con _db(); al cerrar el contexto
+# se cierran los cursores reutilizados y se devuelve al pool solo si se llegó a usar.
+@app.teardown_appcontext
+def teardown_db(exception):
+    for cur in g.pop("_cursores", {}).values():
+        try:
+            cur.close()
+        except Exception:
+            pass
+    conn = g.pop("db_conn", None)
     if conn is not None:
         try:
-            conn.close()
+            release_db_connection(conn)
         except Exception:
             pass
 
 # ---------------------------
 # Inicialización de tablas mínimas
 # ---------------------------
-def inicializar_tablas_minimas():
+DDL_ADVISORY_LOCK = 727101
+
+DDL_POSTGRES = """
+    CREATE TABLE IF NOT EXISTS maestros (
+        id SERIAL PRIMARY KEY,
+        usuario TEXT UNIQUE NOT NULL,
+        contrasena TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS administrativos (
+        id SERIAL PRIMARY KEY,
+        usuario TEXT UNIQUE NOT NULL,
+        contrasena TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS estudiantes (
+        id SERIAL PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        matricula TEXT UNIQUE NOT NULL,
+        licenciatura TEXT,
+        semestre INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS materias (
+        id SERIAL PRIMARY KEY,
+        nombre TEXT NOT NULL,
+        licenciatura TEXT NOT NULL,
+        semestre INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS calificaciones (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        materia INTEGER NOT NULL,
+        calificacion numeric,
+        FOREIGN KEY(user_id) REFERENCES estudiantes(id),
+        FOREIGN KEY(materia) REFERENCES materias(id)
+    );
+    CREATE TABLE IF NOT EXISTS licenciaturas_materias (
+        id SERIAL PRIMARY KEY,
+        materia_id INTEGER,
+        licenciatura TEXT,
+        semestre INTEGER
+    );
+"""
+
+DDL_SQLITE = """
+    CREATE TABLE IF NOT EXISTS maestros (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario TEXT UNIQUE NOT NULL,
+        contrasena TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS administrativos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        usuario TEXT UNIQUE NOT NULL,
+        contrasena TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS estudiantes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        matricula TEXT UNIQUE NOT NULL,
+        licenciatura TEXT,
+        semestre INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS materias (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        licenciatura TEXT NOT NULL,
+        semestre INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS calificaciones (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        materia INTEGER NOT NULL,
+        calificacion REAL,
+        FOREIGN KEY(user_id) REFERENCES estudiantes(id),
+        FOREIGN KEY(materia) REFERENCES materias(id)
+    );
+    CREATE TABLE IF NOT EXISTS licenciaturas_materias (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        materia_id INTEGER,
+        licenciatura TEXT,
+        semestre INTEGER
+    );
+"""
+
+# Índices UNIQUE que necesitan los UPSERT de la app: ux_calif_user_mat
+# (ON CONFLICT (user_id, materia)) y ux_est_matricula (ON CONFLICT (matricula)
+# de /datos_alumnos; las bases antiguas tienen matricula sin UNIQUE). Van
+# aparte de DDL_INDICES porque sin ellos fallan esas escrituras. Si hay
+# duplicados no se crean: el arranque nunca borra datos. Las calificaciones
+# repetidas se limpian en /eliminar_duplicados o con `flask initdb --dedupe`
+# (conserva la de menor id); las matrículas repetidas se corrigen a mano.
+INDICE_UNICO_CALIFICACIONES = "ux_calif_user_mat"
+INDICE_UNICO_MATRICULA = "ux_est_matricula"
+QUITAR_CALIFICACIONES_DUPLICADAS_SQL = """
+    DELETE FROM calificaciones WHERE id IN (
+        SELECT id FROM (
+            SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id, materia ORDER BY id) AS rn
+            FROM calificaciones
+        ) d WHERE rn > 1
+    )
+"""
+# nombre → (CREATE, consulta de duplicados, DELETE de duplicados o None, dónde limpiarlos)
+INDICES_UNICOS = MappingProxyType({
+    INDICE_UNICO_CALIFICACIONES: (
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {INDICE_UNICO_CALIFICACIONES} ON calificaciones(user_id, materia)",
+        "SELECT 1 AS hay FROM calificaciones GROUP BY user_id, materia HAVING COUNT(*) > 1 LIMIT 1",
+        QUITAR_CALIFICACIONES_DUPLICADAS_SQL,
+        "/eliminar_duplicados o con `flask initdb --dedupe`",
+    ),
+    INDICE_UNICO_MATRICULA: (
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {INDICE_UNICO_MATRICULA} ON estudiantes(matricula)",
+        "SELECT 1 AS hay FROM estudiantes GROUP BY matricula HAVING COUNT(*) > 1 LIMIT 1",
+        None,
+        "/alumnos (corrige o borra los alumnos con matrícula repetida)",
+    ),
+})
+
+# Resto de índices (mismo SQL en Postgres y SQLite).
+# maestros/administrativos.usuario ya tienen índice por UNIQUE.
+# ux_materias_unica falla (y se registra) mientras haya materias repetidas: se
+# crea en el siguiente initdb después de limpiarlas en /gestion_materias.
+# ANALYZE al final para que el planificador tenga estadísticas de los índices nuevos.
+DDL_INDICES = """
+    CREATE INDEX IF NOT EXISTS ix_calif_materia ON calificaciones(materia);
+    CREATE INDEX IF NOT EXISTS ix_est_nombre_mat ON estudiantes(nombre, matricula);
+    CREATE INDEX IF NOT EXISTS ix_materias_sem ON materias(semestre);
+    CREATE INDEX IF NOT EXISTS ix_materias_dup ON materias(nombre, licenciatura, semestre, id);
+    CREATE UNIQUE INDEX IF NOT EXISTS ux_materias_unica ON materias(nombre, licenciatura, semestre);
+    CREATE INDEX IF NOT EXISTS ix_materias_lic_sem ON materias(licenciatura, semestre, nombre);
+    CREATE INDEX IF NOT EXISTS ix_est_lic_sem ON estudiantes(licenciatura, semestre);
+    CREATE INDEX IF NOT EXISTS ix_lm_lic_sem ON licenciaturas_materias(licenciatura, semestre, materia_id);
+    CREATE INDEX IF NOT EXISTS ix_est_nombre_lic_sem ON estudiantes(nombre, licenciatura, semestre, id);
+    ANALYZE;
+"""
+SENTENCIAS_INDICES = tuple(filter(None, (l.strip() for l in DDL_INDICES.split(";"))))
+
+def _crear_indice_unico(conn, indice, quitar_duplicados=False):
+    """
+    Crea uno de INDICES_UNICOS en su propia transacción. Con filas duplicadas
+    no lo crea y lo avisa en el log (devuelve False), salvo con
+    quitar_duplicados=True (`flask initdb --dedupe`) si el índice tiene un
+    DELETE de duplicados. Cualquier otro error sube: sin estos índices los
+    UPSERT fallan, así que no se deja pasar en silencio.
+    """
+    crear, hay_duplicados, quitar, donde = INDICES_UNICOS[indice]
+    cur = conn.cursor()
+    quitadas = 0
+    try:
+        if quitar_duplicados and quitar:
+            cur.execute(quitar)
+            quitadas = cur.rowcount
+        else:
+            cur.execute(hay_duplicados)
+            if cur.fetchone():
+                conn.rollback()
+                app.logger.error("❌ No se creó %s: hay filas duplicadas. Elimínalas en %s.",
+                                 indice, donde)
+                return False
+        cur.execute(crear)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    if quitadas and quitadas > 0:
+        app.logger.warning("Se eliminaron %s filas duplicadas para crear %s", quitadas, indice)
+    return True
+
+def _crear_indices_unicos(conn, quitar_duplicados=False):
+    for indice in INDICES_UNICOS:
+        _crear_indice_unico(conn, indice, quitar_duplicados)
+
+def _crear_indices(conn):
+    """
+    Crea los índices de consulta uno por uno, cada uno en su transacción:
+    si uno falla se registra y los demás se crean igual.
+    """
+    cur = conn.cursor()
+    try:
+        for sentencia in SENTENCIAS_INDICES:
+            try:
+                cur.execute(sentencia)
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                app.logger.error("❌ Error creando índice (%s): %s", sentencia, e)
+    finally:
+        cur.close()
+
+# último índice de DDL_INDICES: si ya existe (junto con los UNIQUE de
+# INDICES_UNICOS), tablas e índices están creados
+ULTIMO_INDICE = re.findall(r"IF NOT EXISTS (\w+) ON", DDL_INDICES)[-1]
+INDICES_ESQUEMA = (ULTIMO_INDICE, *INDICES_UNICOS)
+
+def _esquema_creado(conn):
+    cur = conn.cursor()
+    try:
+        if _is_sqlite_conn(conn):
+            cur.execute(f"SELECT COUNT(*) AS n FROM sqlite_master WHERE type = 'index' "
+                        f"AND name IN ({', '.join('?' * len(INDICES_ESQUEMA))})",
+                        INDICES_ESQUEMA)
+            return cur.fetchone()['n'] == len(INDICES_ESQUEMA)
+        cur.execute("SELECT bool_and(to_regclass(n) IS NOT NULL) AS ok FROM unnest(%s) AS n",
+                    (list(INDICES_ESQUEMA),))
+        return cur.fetchone()['ok']
+    finally:
+        cur.close()
+
+def inicializar_tablas_minimas(forzar=False, quitar_duplicados=False):
     """
     Crea las tablas principales si no existen.
     Compatible con Postgres y SQLite.
+    Con SKIP_DB_INIT no hace nada; si el esquema ya está creado solo hace
+    una consulta al catálogo en vez de todo el DDL. forzar=True (flask initdb)
+    ignora ambas cosas y repite el DDL idempotente. quitar_duplicados=True
+    (flask initdb --dedupe) borra calificaciones repetidas antes de su UNIQUE.
     """
+    if os.getenv("SKIP_DB_INIT") and not forzar:
+        return
     conn = get_db_connection()
     try:
+        if not forzar and _esquema_creado(conn):
+            return
         if _is_sqlite_conn(conn):
-            cur = conn.cursor()
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS maestros (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    usuario TEXT UNIQUE NOT NULL,
-                    contrasena TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS administrativos (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    usuario TEXT UNIQUE NOT NULL,
-                    contrasena TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS estudiantes (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nombre TEXT NOT NULL,
-                    matricula TEXT UNIQUE NOT NULL,
-                    licenciatura TEXT,
-                    semestre INTEGER
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS materias (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    nombre TEXT NOT NULL,
-                    licenciatura TEXT NOT NULL,
-                    semestre INTEGER NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS calificaciones (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    materia INTEGER NOT NULL,
-                    calificacion REAL,
-                    FOREIGN KEY(user_id) REFERENCES estudiantes(id),
-                    FOREIGN KEY(materia) REFERENCES materias(id)
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS licenciaturas_materias (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    materia_id INTEGER,
-                    licenciatura TEXT,
-                    semestre INTEGER
-                );
-            """)
-            conn.commit()
-            cur.close()
+            # SQLite: todo el DDL en un solo executescript y una transacción
+            conn.executescript("BEGIN;" + DDL_SQLITE + "COMMIT;")
+            _crear_indices_unicos(conn, quitar_duplicados)
+            _crear_indices(conn)
         else:
             cur = conn.cursor()
-            # Postgres: usar SERIAL / small changes
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS maestros (
-                    id SERIAL PRIMARY KEY,
-                    usuario TEXT UNIQUE NOT NULL,
-                    contrasena TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS administrativos (
-                    id SERIAL PRIMARY KEY,
-                    usuario TEXT UNIQUE NOT NULL,
-                    contrasena TEXT NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS estudiantes (
-                    id SERIAL PRIMARY KEY,
-                    nombre TEXT NOT NULL,
-                    matricula TEXT UNIQUE NOT NULL,
-                    licenciatura TEXT,
-                    semestre INTEGER
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS materias (
-                    id SERIAL PRIMARY KEY,
-                    nombre TEXT NOT NULL,
-                    licenciatura TEXT NOT NULL,
-                    semestre INTEGER NOT NULL
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS calificaciones (
-                    id SERIAL PRIMARY KEY,
-                    user_id INTEGER NOT NULL,
-                    materia INTEGER NOT NULL,
-                    calificacion numeric,
-                    FOREIGN KEY(user_id) REFERENCES estudiantes(id),
-                    FOREIGN KEY(materia) REFERENCES materias(id)
-                );
-            """)
-            cur.execute("""
-                CREATE TABLE IF NOT EXISTS licenciaturas_materias (
-                    id SERIAL PRIMARY KEY,
-                    materia_id INTEGER,
-                    licenciatura TEXT,
-                    semestre INTEGER
-                );
-            """)
-            conn.commit()
+            # Postgres: un solo execute con todo el DDL; el advisory lock evita
+            # que varios workers de gunicorn lo ejecuten a la vez
+            cur.execute("SELECT pg_try_advisory_lock(%s) AS ok", (DDL_ADVISORY_LOCK,))
+            if cur.fetchone()['ok']:
+                try:
+                    cur.execute(DDL_POSTGRES)
+                    conn.commit()
+                    _crear_indices_unicos(conn, quitar_duplicados)
+                    _crear_indices(conn)
+                finally:
+                    conn.rollback()
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (DDL_ADVISORY_LOCK,))
+                    conn.commit()
             cur.close()
     finally:
-        conn.close()
+        release_db_connection(conn)
+
+@app.cli.command('initdb')
+@click.option('--dedupe', is_flag=True,
+              help='Borra calificaciones duplicadas (conserva la de menor id) antes del UNIQUE.')
+def initdb_command(dedupe):
+    """Crea tablas e índices (flask --app app initdb). Se ejecuta en el build."""
+    inicializar_tablas_minimas(forzar=True, quitar_duplicados=dedupe)
+    click.echo("✅ Esquema creado/actualizado")
+
+# inicializar tablas al importar el módulo (también bajo gunicorn).
+# Es idempotente (CREATE IF NOT EXISTS), los workers que arrancan con el
+# esquema ya creado no repiten el DDL y en Postgres solo un worker a la vez
+# lo ejecuta gracias al advisory lock. En producción SKIP_DB_INIT lo salta:
+# el esquema lo crea `flask initdb` en el build, fuera del arranque.
+with app.app_context():
+    try:
+        inicializar_tablas_minimas()
+    except Exception:
+        app.logger.exception("❌ Error inicializando tablas")
 
-# inicializar tablas al arrancar (solo en ejecución directa)
-# NOTA: si usás gunicorn en render, la inicialización puede repetirse en workers.
-# Lo hacemos de forma segura (CREATE IF NOT EXISTS).
-if __name__ == '__main__':
-    inicializar_tablas_minimas()
+# ---------------------------
+# Usuarios (docentes / admins) cacheados
+# ---------------------------
+@cache.memoize(timeout=60)
+def _get_user(tabla, usuario):
+    """
+    Busca un docente/admin por nombre de usuario. El resultado se cachea
+    y se invalida con _invalidar_usuarios() en cada escritura.
+    """
+    row = db_query_preparada(QUERIES['sel_by_usuario', tabla], (usuario,), one=True)
+    return row
+
+def _pagina_usuarios(usuarios):
+    # se pide una fila de más para saber si hay página siguiente
+    if len(usuarios) > USUARIOS_POR_PAGINA:
+        usuarios = usuarios[:USUARIOS_POR_PAGINA]
+        return usuarios, usuarios[-1]['usuario']
+    return usuarios, None
+
+@cache.memoize(timeout=300)
+def _usuarios_por_tipo(desde_docente='', desde_admin=''):
+    """
+    (docentes, administrativos, siguiente_docente, siguiente_admin): una página
+    de cada tabla ordenada por usuario, en un solo round-trip. siguiente_* es
+    el usuario desde el que sigue la próxima página, o None si no hay más.
+    """
+    limite = USUARIOS_POR_PAGINA + 1
+    usuarios = db_query(
+        USUARIOS_POR_TIPO_SQL, (desde_docente, limite, desde_admin, limite), one=False) or []
+    docentes, sig_docente = _pagina_usuarios([u for u in usuarios if u['tipo'] == 'docente'])
+    admins, sig_admin = _pagina_usuarios([u for u in usuarios if u['tipo'] == 'administrativo'])
+    return docentes, admins, sig_docente, sig_admin
+
+def _paginacion_usuarios():
+    """Cursores de página (?desde_docente=&desde_admin=) del listado de usuarios."""
+    return request.args.get('desde_docente', ''), request.args.get('desde_admin', '')
+
+def _invalidar_usuarios():
+    cache.delete_memoized(_get_user)
+    cache.delete_memoized(_usuarios_por_tipo)
+
+# argon2id: ~15 ms por hash con 19 MiB de memoria (parámetros mínimos de OWASP).
+# El costo se ajusta por entorno sin tocar código: el tiempo crece casi lineal
+# con ARGON2_TIME_COST × ARGON2_MEMORY_KIB; medirlo en la CPU del despliegue y
+# no pasar de ~100 ms por login. Los hashes ya guardados se siguen verificando
+# con sus propios parámetros (van codificados en el hash).
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', 2))
+ARGON2_MEMORY_KIB = int(os.getenv('ARGON2_MEMORY_KIB', 19456))
+_argon2 = (PasswordHasher(time_cost=ARGON2_TIME_COST, memory_cost=ARGON2_MEMORY_KIB, parallelism=1)
+           if PasswordHasher is not None else None)
+
+# Con workers gevent el KDF (CPU pura) se calcula en el threadpool nativo del
+# hub para no bloquear a los demás greenlets. Con workers síncronos se llama
+# directo: mandarlo a otro hilo y esperar el resultado no libera al worker.
+HASH_WORKERS = int(os.getenv('HASH_WORKERS', max(2, (os.cpu_count() or 2) // 2)))
+
+def _en_hilo_hash(fn, *args):
+    if get_hub is not None and is_module_patched('threading'):
+        hub = get_hub()
+        if hub.threadpool.maxsize < HASH_WORKERS:
+            hub.threadpool.maxsize = HASH_WORKERS
+        return hub.threadpool.apply(fn, args)
+    return fn(*args)
+
+def _hash_password(contrasena):
+    return _en_hilo_hash(_generar_hash, contrasena)
+
+def _generar_hash(contrasena):
+    if PW_METHOD == 'argon2':
+        if _argon2 is not None:
+            return _argon2.hash(contrasena)
+        return generate_password_hash(contrasena, method='scrypt')
+    return generate_password_hash(contrasena, method=PW_METHOD)
+
+def _check_hash(hashed, contrasena):
+    # argon2 ("$argon2id$...") o cualquier formato de werkzeug ("scrypt:...", "pbkdf2:...")
+    if hashed.startswith('$argon2'):
+        if _argon2 is None:
+            return False
+        try:
+            return _argon2.verify(hashed, contrasena)
+        except (VerificationError, InvalidHashError):
+            return False
+    return check_password_hash(hashed, contrasena)
+
+def _hashed(row):
+    """Hash guardado en una fila de usuario, o None."""
+    return row['contrasena'] if row else None
+
+# (hash, huella HMAC de la contraseña) ya verificados: un login repetido con
+# credenciales correctas no vuelve a pagar el hash. Los fallos no se guardan,
+# así que un intento erróneo siempre cuesta el hash completo.
+_verificados = set()
+VERIFICADOS_MAX = 1024
+# Ninguna verificación responde antes de PW_MIN_SEGUNDOS: el tiempo de
+# respuesta no distingue un acierto en _verificados, un usuario inexistente
+# o un hash completo (el ahorro de CPU del caché se mantiene).
+PW_MIN_SEGUNDOS = float(os.getenv("PW_MIN_SEGUNDOS", 0.1))
+
+@lru_cache(maxsize=1)
+def _hash_ficticio():
+    # usuario inexistente: se verifica contra este hash para pagar el mismo costo
+    return _hash_password(os.urandom(16).hex())
+
+def _verificar_password(row, contrasena):
+    # argon2 y check_password_hash comparan en tiempo constante
+    inicio = time.monotonic()
+    hashed = _hashed(row)
+    clave = (hashed, hmac.digest(app.secret_key.encode(), contrasena.encode(), 'sha256'))
+    if hashed and clave in _verificados:
+        ok = True
+    else:
+        ok = _en_hilo_hash(_check_hash, hashed or _hash_ficticio(), contrasena) and bool(hashed)
+        if ok:
+            if len(_verificados) >= VERIFICADOS_MAX:
+                _verificados.clear()
+            _verificados.add(clave)
+    espera = PW_MIN_SEGUNDOS - (time.monotonic() - inicio)
+    if espera > 0:
+        time.sleep(espera)
+    return hmac.compare_digest(b'\x01' if ok else b'\x00', b'\x01')
+
+# ---------------------------
+# Versión del dashboard (se invalida al escribir calificaciones)
+# ---------------------------
+def _dashboard_cache_key():
+    return f"dashboard_v{cache.get('dash_ver') or 0}"
+
+def _invalidar_dashboard():
+    # también deja sin efecto las calificaciones adelantadas (_clave_prefetch)
+    cache.set('dash_ver', (cache.get('dash_ver') or 0) + 1, timeout=0)
+
+# ---------------------------
+# ETag de listados poco cambiantes (/alumnos, /ver_materias)
+# ---------------------------
+def _version(nombre):
+    # arranca con la hora para no coincidir con ETags de un arranque anterior
+    ver = cache.get(f'ver_{nombre}')
+    if ver is None:
+        ver = time.time_ns()
+        cache.add(f'ver_{nombre}', ver, timeout=0)
+    return ver
+
+def _subir_version(nombre):
+    cache.set(f'ver_{nombre}', time.time_ns(), timeout=0)
+
+def _respuesta_condicional(nombre, generar):
+    """
+    Respuesta con ETag débil según la versión del listado. Si el navegador ya
+    tiene esa versión se contesta 304 sin consultar la base ni renderizar.
+    no-cache: el navegador siempre revalida, así ve enseguida sus propios cambios.
+    """
+    etag = f"{nombre}-{_version(nombre)}"
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+    else:
+        resp = make_response(generar())
+    resp.set_etag(etag, weak=True)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+# ---------------------------
+# Calificaciones: UPSERT en un solo round-trip
+# ---------------------------
+UPSERT_CALIFICACION = """
+    INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)
+    ON CONFLICT (user_id, materia) DO UPDATE SET calificacion = EXCLUDED.calificacion
+"""
+# xmax = 0 solo en filas recién insertadas (Postgres); SQLite no lo expone
+UPSERT_CALIFICACION_PG = UPSERT_CALIFICACION + " RETURNING (xmax = 0) AS inserted"
+UPSERT_CALIFICACION_SQLITE = UPSERT_CALIFICACION + " RETURNING NULL AS inserted"
+
+def _usa_sqlite():
+    if has_app_context():
+        return _is_sqlite_conn(_db())
+    return not os.getenv("DATABASE_URL")
+
+def _upsert_calificacion(alumno_id, materia_id, calificacion):
+    """
+    Inserta o actualiza la calificación de (alumno, materia).
+    Devuelve True si fue alta, False si fue actualización, None si no se sabe (SQLite).
+    """
+    sql = UPSERT_CALIFICACION_SQLITE if _usa_sqlite() else UPSERT_CALIFICACION_PG
+    row = db_query_preparada(sql, (alumno_id, materia_id, calificacion),
+                             one=True, commit=True)
+    _invalidar_dashboard()
+    return row.get('inserted') if row else None
+
+# Varias materias de un alumno en una sola sentencia (db_query many_params)
+UPSERT_CALIFICACIONES_LOTE = """
+    INSERT INTO calificaciones (user_id, materia, calificacion) VALUES %s
+    ON CONFLICT (user_id, materia) DO UPDATE SET calificacion = EXCLUDED.calificacion
+"""
+
+def _upsert_calificaciones(alumno_id, materias_ids, calificaciones):
+    """
+    Guarda en bloque las calificaciones de un alumno (una por materia).
+    Devuelve cuántas se enviaron.
+    """
+    filas = [(alumno_id, materia_id, calificacion)
+             for materia_id, calificacion in zip(materias_ids, calificaciones, strict=True)]
+    db_query(UPSERT_CALIFICACIONES_LOTE, many_params=filas, commit=True)
+    _invalidar_dashboard()
+    return len(filas)
+
+# DELETE por lista de ids, precalculado por (tabla, motor): texto fijo por tabla
+ELIMINAR_POR_IDS = MappingProxyType({
+    **{(tabla, 'sqlite'): f"DELETE FROM {tabla} WHERE id IN (SELECT value FROM json_each(%s))"
+       for tabla in ('calificaciones', 'materias')},
+    **{(tabla, 'pg'): f"DELETE FROM {tabla} WHERE id = ANY(%s)"
+       for tabla in ('calificaciones', 'materias')},
+})
+
+def _eliminar_por_ids(tabla, ids):
+    """
+    Borra varias filas de `tabla` en una sola sentencia y un solo commit.
+    Devuelve cuántas se borraron. Solo hay SQL para las tablas de
+    ELIMINAR_POR_IDS (KeyError con cualquier otra).
+    La lista va como un solo parámetro (arreglo en Postgres, JSON en SQLite):
+    el SQL es el mismo para cualquier cantidad de ids, así que no llena la
+    caché de _to_sqlite ni la de sentencias de sqlite3 con variantes del IN.
+    """
+    if _usa_sqlite():
+        return db_query(ELIMINAR_POR_IDS[tabla, 'sqlite'],
+                        (app.json.dumps(list(ids)),), commit=True, write_only=True)
+    return db_query(ELIMINAR_POR_IDS[tabla, 'pg'], (list(ids),),
+                    commit=True, write_only=True)
+
+def _mensaje_upsert(inserted):
+    if inserted is None:
+        return '✅ Calificación guardada con éxito.'
+    return '✅ Calificación registrada con éxito.' if inserted else '🔄 Calificación actualizada con éxito.'
 
 # ---------------------------
 # Rutas
@@ -257,12 +1047,24 @@ def index():
             return redirect(url_for('menu_admin'))
 
     # Si no está logueado, mostrar pantalla de selección de rol
+    return _html_seleccionar_rol()
+
+@lru_cache(maxsize=1)
+def _html_seleccionar_rol():
+    # página sin datos de sesión ni flashes (solo url_for): se renderiza una
+    # vez por proceso, en la primera petición, y luego se sirve la cadena
     return render_template('seleccionar_rol.html')
 
 # Mantener endpoint solicitado por plantillas
 @app.route('/seleccionar-rol')
 def seleccionar_rol():
-    return render_template('seleccionar_rol.html')
+    # siempre la misma página: el navegador la guarda una hora y después
+    # revalida con el ETag (304 sin cuerpo). En '/' no, porque redirige
+    # según la sesión.
+    resp = make_response(_html_seleccionar_rol())
+    resp.add_etag()
+    resp.headers['Cache-Control'] = 'public, max-age=3600'
+    return resp.make_conditional(request)
 
 # --------------------------------------------------
 # Menús (docente / admin)
@@ -300,24 +1102,25 @@ def registrar_usuario():
             flash('Todos los campos son obligatorios')
             return redirect(url_for('registrar_usuario'))
 
-        tabla = 'maestros' if tipo == 'docente' else 'administrativos' if tipo == 'administrativo' else None
+        tabla = TABLA_POR_TIPO.get(tipo)
         if tabla is None:
             flash('Tipo de usuario no válido')
             return redirect(url_for('registrar_usuario'))
 
-        existe = db_query(f"SELECT * FROM {tabla} WHERE usuario = %s", (usuario,), one=True)
-        if existe:
+        contrasena_hash = _hash_password(contrasena)
+        nuevo = db_query(QUERIES['insert', tabla], (usuario, contrasena_hash), one=True, commit=True)
+        if not nuevo:
             flash(f'El usuario "{usuario}" ya está registrado como {tipo}')
             return redirect(url_for('registrar_usuario'))
-
-        contrasena_hash = generate_password_hash(contrasena)
-        db_query(f"INSERT INTO {tabla} (usuario, contrasena) VALUES (%s, %s)", (usuario, contrasena_hash), commit=True)
+        _invalidar_usuarios()
         flash(f'Usuario "{usuario}" registrado exitosamente como {tipo}')
         return redirect(url_for('registrar_usuario'))
 
-    docentes = db_query("SELECT id, usuario, contrasena FROM maestros ORDER BY id", one=False) or []
-    administrativos = db_query("SELECT id, usuario, contrasena FROM administrativos ORDER BY id", one=False) or []
-    return render_template('registrar_usuario.html', docentes=docentes, administrativos=administrativos)
+    desde_docente, desde_admin = _paginacion_usuarios()
+    docentes, administrativos, sig_docente, sig_admin = _usuarios_por_tipo(desde_docente, desde_admin)
+    return render_template('registrar_usuario.html', docentes=docentes, administrativos=administrativos,
+                           desde_docente=desde_docente, desde_admin=desde_admin,
+                           sig_docente=sig_docente, sig_admin=sig_admin)
 
 @app.route('/registro_usuario_publico', methods=['GET', 'POST'])
 def registrar_usuario_publico():
@@ -330,18 +1133,17 @@ def registrar_usuario_publico():
             flash('Todos los campos son obligatorios')
             return redirect(url_for('registrar_usuario_publico'))
 
-        tabla = 'maestros' if tipo == 'docente' else 'administrativos' if tipo == 'administrativo' else None
+        tabla = TABLA_POR_TIPO.get(tipo)
         if tabla is None:
             flash('Tipo de usuario no válido')
             return redirect(url_for('registrar_usuario_publico'))
 
-        existe = db_query(f"SELECT * FROM {tabla} WHERE usuario = %s", (usuario,), one=True)
-        if existe:
+        contrasena_hash = _hash_password(contrasena)
+        nuevo = db_query(QUERIES['insert', tabla], (usuario, contrasena_hash), one=True, commit=True)
+        if not nuevo:
             flash(f'El usuario "{usuario}" ya está registrado como {tipo}')
             return redirect(url_for('registrar_usuario_publico'))
-
-        contrasena_hash = generate_password_hash(contrasena)
-        db_query(f"INSERT INTO {tabla} (usuario, contrasena) VALUES (%s, %s)", (usuario, contrasena_hash), commit=True)
+        _invalidar_usuarios()
         flash('¡Registro exitoso! Ahora puedes iniciar sesión.')
         return redirect(url_for('login_docente') if tipo == 'docente' else url_for('login_admin'))
 
@@ -353,20 +1155,22 @@ def ver_usuarios():
         flash('Acceso restringido')
         return redirect(url_for('login_admin'))
 
-    docentes = db_query("SELECT id, usuario FROM maestros ORDER BY usuario",one=False) or []
-    admins = db_query("SELECT id, usuario FROM administrativos ORDER BY usuario", one=False) or []
+    desde_docente, desde_admin = _paginacion_usuarios()
+    docentes, admins, sig_docente, sig_admin = _usuarios_por_tipo(desde_docente, desde_admin)
 
     tipo = request.args.get('tipo')
     user_id = request.args.get('user_id')
     usuario_editar = None
     tipo_edicion = None
-    if tipo in ['docente', 'administrativo'] and user_id:
-        tabla = 'maestros' if tipo == 'docente' else 'administrativos'
-        usuario_editar = db_query(f"SELECT * FROM {tabla} WHERE id = %s", (user_id,), one=True)
+    if tipo in TABLA_POR_TIPO and user_id:
+        tabla = TABLA_POR_TIPO[tipo]
+        usuario_editar = db_query(QUERIES['sel_by_id', tabla], (user_id,), one=True)
         tipo_edicion = tipo
 
     return render_template('ver_usuarios.html', docentes=docentes, admins=admins,
-                           usuario_editar=usuario_editar, tipo_edicion=tipo_edicion)
+                           usuario_editar=usuario_editar, tipo_edicion=tipo_edicion,
+                           desde_docente=desde_docente, desde_admin=desde_admin,
+                           sig_docente=sig_docente, sig_admin=sig_admin)
 
 @app.route('/eliminar_usuario')
 def eliminar_usuario():
@@ -377,18 +1181,17 @@ def eliminar_usuario():
     tipo = request.args.get('tipo')
     user_id = request.args.get('user_id')
 
-    if tipo not in ['docente', 'administrativo'] or not user_id or not user_id.isdigit():
+    if tipo not in TABLA_POR_TIPO or not user_id or not user_id.isdigit():
         flash('Datos inválidos para eliminar usuario ❌')
         return redirect(url_for('registrar_usuario'))
 
-    tabla = 'maestros' if tipo == 'docente' else 'administrativos'
-    resultado = db_query(f"SELECT usuario FROM {tabla} WHERE id = %s", (user_id,), one=True)
+    tabla = TABLA_POR_TIPO[tipo]
+    resultado = db_query(QUERIES['sel_by_id', tabla], (user_id,), one=True)
 
     if resultado:
-        db_query(f"DELETE FROM {tabla} WHERE id = %s", (user_id,), commit=True)
-        # resultado puede ser dict o tuple según connector; manejamos ambos
-        usuario_str = resultado.get('usuario') if isinstance(resultado, dict) else resultado[0]
-        flash(f'Usuario "{usuario_str}" eliminado correctamente ✅')
+        db_query(QUERIES['delete', tabla], (user_id,), commit=True, write_only=True)
+        _invalidar_usuarios()
+        flash(f'Usuario "{resultado["usuario"]}" eliminado correctamente ✅')
     else:
         flash('Usuario no encontrado ❌')
 
@@ -401,18 +1204,24 @@ def actualizar_usuario():
     nuevo_usuario = request.form.get('usuario', '').strip()
     nueva_contrasena = request.form.get('contrasena', '').strip()
 
-    if tipo not in ['docente', 'administrativo'] or not user_id or not nuevo_usuario:
+    if tipo not in TABLA_POR_TIPO or not user_id or not nuevo_usuario:
         flash('Datos inválidos')
         return redirect(url_for('ver_usuarios'))
 
-    tabla = 'maestros' if tipo == 'docente' else 'administrativos'
+    tabla = TABLA_POR_TIPO[tipo]
+    # la contraseña siempre se guarda hasheada; sin contraseña nueva no se
+    # calcula ningún hash y el UPDATE no toca la columna
     if nueva_contrasena:
-        nueva_hash = generate_password_hash(nueva_contrasena)
-        db_query(f"UPDATE {tabla} SET usuario = %s, contrasena = %s WHERE id = %s",
-                 (nuevo_usuario, nueva_hash, user_id), commit=True)
+        nueva_hash = _hash_password(nueva_contrasena)
+        actualizados = db_query(QUERIES['update_with_pw', tabla],
+                                (nuevo_usuario, nueva_hash, user_id), commit=True, write_only=True)
     else:
-        db_query(f"UPDATE {tabla} SET usuario = %s WHERE id = %s",
-                 (nuevo_usuario, user_id), commit=True)
+        actualizados = db_query(QUERIES['update_no_pw', tabla],
+                                (nuevo_usuario, user_id), commit=True, write_only=True)
+    if not actualizados:
+        flash('Usuario no encontrado')
+        return redirect(url_for('ver_usuarios'))
+    _invalidar_usuarios()
 
     flash('✅ Usuario actualizado correctamente')
     return redirect(url_for('ver_usuarios'))
@@ -422,7 +1231,7 @@ def actualizar_usuario():
 # --------------------------------------------------
 @app.route('/cambiar-contrasena', methods=['GET', 'POST'])
 def cambiar_contrasena():
-    if 'user_id' not in session or session.get('usuario_tipo') not in ['docente', 'admin']:
+    if 'user_id' not in session or session.get('usuario_tipo') not in ROLES_ADMIN_O_DOCENTE:
         flash('Acceso restringido.')
         return redirect(url_for('login'))
 
@@ -431,20 +1240,12 @@ def cambiar_contrasena():
         nueva = request.form.get('nueva_contrasena', '').strip()
         confirmar = request.form.get('confirmar_contrasena', '').strip()
 
-        # buscamos en maestros (si es docente)
-        if session.get('usuario_tipo') == 'docente':
-            docente = db_query("SELECT contrasena FROM maestros WHERE id = %s", (session['user_id'],), one=True)
-            hashed = docente.get('contrasena') if isinstance(docente, dict) else (docente[0] if docente else None)
-            if not hashed or not check_password_hash(hashed, actual):
-                flash('❌ La contraseña actual no es correcta.')
-                return redirect(url_for('cambiar_contrasena'))
-        else:
-            # admin: buscar en administrativos
-            admin = db_query("SELECT contrasena FROM administrativos WHERE id = %s", (session['user_id'],), one=True)
-            hashed = admin.get('contrasena') if isinstance(admin, dict) else (admin[0] if admin else None)
-            if not hashed or not check_password_hash(hashed, actual):
-                flash('❌ La contraseña actual no es correcta.')
-                return redirect(url_for('cambiar_contrasena'))
+        # docente → maestros, admin → administrativos
+        tabla = 'maestros' if session.get('usuario_tipo') == 'docente' else 'administrativos'
+        usuario = db_query_preparada(QUERIES['sel_pw_by_id', tabla], (session['user_id'],), one=True)
+        if not _verificar_password(usuario, actual):
+            flash('❌ La contraseña actual no es correcta.')
+            return redirect(url_for('cambiar_contrasena'))
 
         if nueva != confirmar:
             flash('⚠️ Las nuevas contraseñas no coinciden.')
@@ -454,11 +1255,9 @@ def cambiar_contrasena():
             flash('🚫 La nueva contraseña no puede estar vacía.')
             return redirect(url_for('cambiar_contrasena'))
 
-        nueva_hash = generate_password_hash(nueva)
-        if session.get('usuario_tipo') == 'docente':
-            db_query("UPDATE maestros SET contrasena = %s WHERE id = %s", (nueva_hash, session['user_id']), commit=True)
-        else:
-            db_query("UPDATE administrativos SET contrasena = %s WHERE id = %s", (nueva_hash, session['user_id']), commit=True)
+        nueva_hash = _hash_password(nueva)
+        db_query(QUERIES['update_pw', tabla], (nueva_hash, session['user_id']), commit=True, write_only=True)
+        _invalidar_usuarios()
 
         flash('✅ Contraseña actualizada con éxito.')
         return redirect(url_for('cambiar_contrasena'))
@@ -467,10 +1266,18 @@ def cambiar_contrasena():
 
 @app.route('/actualizar_contrasena/<tipo>/<int:user_id>', methods=['GET', 'POST'])
 def actualizar_contrasena(tipo, user_id):
-    tabla = 'maestros' if tipo == 'docente' else 'administrativos'
+    # Seguridad: solo admins pueden cambiar la contraseña de otro usuario
+    if session.get('usuario_tipo') != 'admin':
+        flash('Acceso restringido. Solo administradores.')
+        return redirect(url_for('seleccionar_rol'))
+
+    tabla = TABLA_POR_TIPO.get(tipo)
+    if tabla is None:
+        flash('Tipo de usuario no válido')
+        return redirect(url_for('registrar_usuario'))
 
     # Obtener un solo usuario usando "one=True"
-    usuario = db_query(f"SELECT * FROM {tabla} WHERE id = %s", (user_id,), one=True)
+    usuario = db_query(QUERIES['sel_by_id', tabla], (user_id,), one=True)
 
     if not usuario:
         flash("❌ Usuario no encontrado.")
@@ -478,14 +1285,18 @@ def actualizar_contrasena(tipo, user_id):
 
     # Si envían el formulario
     if request.method == 'POST':
-        nueva = request.form.get('nueva_contrasena')
-        hash_ = generate_password_hash(nueva)
+        nueva = request.form.get('nueva_contrasena', '').strip()
+        if not nueva:
+            flash('🚫 La nueva contraseña no puede estar vacía.')
+            return redirect(url_for('actualizar_contrasena', tipo=tipo, user_id=user_id))
+        hash_ = _hash_password(nueva)
 
         db_query(
-            f"UPDATE {tabla} SET contrasena = %s WHERE id = %s",
+            QUERIES['update_pw', tabla],
             (hash_, user_id),
-            commit=True
+            commit=True, write_only=True
         )
+        _invalidar_usuarios()
 
         flash("✅ Contraseña actualizada correctamente.")
         return redirect(url_for('registrar_usuario'))
@@ -516,12 +1327,11 @@ def login_docente():
         usuario = request.form.get('usuario', '').strip()
         contrasena = request.form.get('contrasena', '').strip()
 
-        docente = db_query("SELECT * FROM maestros WHERE usuario = %s", (usuario,), one=True)
+        docente = _get_user('maestros', usuario)
         if docente:
-            hashed = docente.get('contrasena') if isinstance(docente, dict) else docente[2]
-            docente_id = docente.get('id') if isinstance(docente, dict) else docente[0]
-            docente_usuario = docente.get('usuario') if isinstance(docente, dict) else docente[1]
-            if hashed and check_password_hash(hashed, contrasena):
+            docente_id = docente['id']
+            docente_usuario = docente['usuario']
+            if _verificar_password(docente, contrasena):
                 session['user_id'] = docente_id
                 session['usuario_tipo'] = 'docente'
                 session['usuario'] = docente_usuario
@@ -537,15 +1347,10 @@ def login_admin():
         usuario = request.form.get('usuario', '').strip()
         contrasena = request.form.get('contrasena', '').strip()
 
-        admin = db_query(
-            "SELECT id, usuario, contrasena FROM administrativos WHERE usuario = %s",
-            (usuario,),
-            one=True
-        )
+        admin = _get_user('administrativos', usuario)
 
         if admin:
-            hashed = admin['contrasena']
-            if check_password_hash(hashed, contrasena):
+            if _verificar_password(admin, contrasena):
                 session['user_id'] = admin['id']
                 session['usuario_tipo'] = 'admin'
                 session['usuario'] = admin['usuario']
@@ -557,6 +1362,11 @@ def login_admin():
 
     return render_template('login_admin.html')
 
+LOGIN_ESTUDIANTE_SQL = (
+    "SELECT id, nombre, matricula, semestre, licenciatura FROM estudiantes "
+    "WHERE nombre = %s AND matricula = %s"
+)
+
 # Student login: endpoint name used in templates puede variar.
 # Nosotros definimos dos endpoints por compatibilidad:
 @app.route('/login', methods=['GET', 'POST'])
@@ -564,13 +1374,11 @@ def login():
     if request.method == 'POST':
         nombre = request.form.get('nombre', '').strip()
         matricula = request.form.get('matricula', '').strip()
-        user = db_query("SELECT id, nombre, matricula, semestre, licenciatura FROM estudiantes WHERE nombre = %s AND matricula = %s",
-                        (nombre, matricula), one=True)
+        user = db_query_preparada(LOGIN_ESTUDIANTE_SQL, (nombre, matricula), one=True)
         if user:
-            # user is dict
-            session['user_id'] = user.get('id') if isinstance(user, dict) else user[0]
+            session['user_id'] = user['id']
             session['usuario_tipo'] = 'estudiante'
-            session['usuario'] = user.get('nombre') if isinstance(user, dict) else user[1]
+            session['usuario'] = user['nombre']
             return redirect(url_for('ver_calificaciones'))
         else:
             flash('Nombre o matrícula incorrectos ❌')
@@ -583,24 +1391,51 @@ def mostrar_login_estudiante():
     return redirect(url_for('login'))
 
 # --------------------------------------------------
-# Dashboard (ejemplo con plotly)
+# Dashboard (histograma en SVG)
 # --------------------------------------------------
+# Histograma calculado en SQL (10 intervalos de 1 punto, el 10 cae en el último):
+# solo viajan ~10 filas en vez de toda la tabla calificaciones
+DASHBOARD_HISTOGRAMA_PG = """
+    SELECT LEAST(width_bucket(calificacion, 0, 10, 10), 10) AS intervalo, COUNT(*) AS total
+    FROM calificaciones
+    WHERE calificacion IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1
+"""
+DASHBOARD_HISTOGRAMA_SQLITE = """
+    SELECT MIN(CAST(calificacion AS INTEGER) + 1, 10) AS intervalo, COUNT(*) AS total
+    FROM calificaciones
+    WHERE calificacion IS NOT NULL
+    GROUP BY 1
+    ORDER BY 1
+"""
+
 @app.route('/dashboard')
+@cache.cached(timeout=3600, key_prefix=_dashboard_cache_key)
 def dashboard():
-    calificaciones = db_query("SELECT * FROM calificaciones", one=False) or []
-    if not calificaciones:
-        return render_template('dashboard.html', graph_html=None)
-    # construimos DataFrame cuidando las keys
-    import pandas as pd
-    df = pd.DataFrame(calificaciones)
-    import plotly.express as px
-    fig = px.histogram(df, x='calificacion', nbins=10, title='Distribución de Calificaciones')
-    graph_html = fig.to_html(full_html=False)
-    return render_template('dashboard.html', graph_html=graph_html)
+    sql = DASHBOARD_HISTOGRAMA_SQLITE if _usa_sqlite() else DASHBOARD_HISTOGRAMA_PG
+    histograma = db_query(sql, one=False) or []
+    # a lo sumo 10 intervalos ya agregados en SQL: el template los dibuja como
+    # barras <rect> de un SVG en línea, sin plotly ni JS en el cliente
+    maximo = max((r['total'] for r in histograma), default=0)
+    barras = [{'intervalo': r['intervalo'],
+               'total': r['total'],
+               'altura': round(200 * r['total'] / maximo)} for r in histograma]
+    return render_template('dashboard.html', barras=barras)
 
 # --------------------------------------------------
 # Ver y gestionar calificaciones (varias rutas)
 # --------------------------------------------------
+VER_CALIFICACIONES_SQL = '''
+    SELECT c.calificacion, m.nombre AS materia_nombre, e.nombre AS estudiante_nombre,
+           e.semestre AS estudiante_semestre, m.semestre
+    FROM estudiantes e
+    LEFT JOIN (calificaciones c JOIN materias m ON c.materia = m.id)
+           ON c.user_id = e.id AND m.semestre = e.semestre
+    WHERE e.id = %s
+    ORDER BY m.nombre
+'''
+
 @app.route('/ver_calificaciones', methods=['GET'])
 def ver_calificaciones():
     try:
@@ -608,24 +1443,27 @@ def ver_calificaciones():
         if not user_id:
             return redirect(url_for('index'))
 
-        estudiante = db_query("SELECT nombre, semestre FROM estudiantes WHERE id = %s", (user_id,), one=True)
-        if not estudiante:
+        # Alumno y calificaciones de su semestre actual en un solo round-trip;
+        # el LEFT JOIN deja una fila con calificacion NULL si aún no tiene ninguna
+        filas = db_query_preparada(VER_CALIFICACIONES_SQL, (user_id,)) or []
+        if not filas:
             return render_template('calificaciones.html', calificaciones=None)
 
-        nombre_estudiante = estudiante.get('nombre') if isinstance(estudiante, dict) else estudiante[0]
-        semestre_actual = estudiante.get('semestre') if isinstance(estudiante, dict) else estudiante[1]
+        # datos del alumno: una vez, desde la primera fila
+        estudiante_nombre = filas[0]['estudiante_nombre']
+        semestre_actual = filas[0]['estudiante_semestre']
+        calificaciones = [f for f in filas if f['materia_nombre'] is not None]
 
-        calificaciones = db_query('''
-            SELECT c.calificacion, m.nombre AS materia_nombre, %s AS estudiante_nombre, %s AS estudiante_semestre, m.semestre
-            FROM calificaciones c
-            JOIN materias m ON c.materia = m.id
-            WHERE c.user_id = %s AND m.semestre = %s
-        ''', (nombre_estudiante, semestre_actual, user_id, semestre_actual), one=False)
-
-        return render_template('calificaciones.html', calificaciones=calificaciones, semestre_actual=semestre_actual)
+        return render_template('calificaciones.html', calificaciones=calificaciones,
+                               estudiante_nombre=estudiante_nombre, semestre_actual=semestre_actual)
     except Exception as e:
         return f"Ha ocurrido un error: {str(e)}", 500
 
+INSERTAR_CALIFICACION_SQL = """
+    INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)
+    ON CONFLICT (user_id, materia) DO NOTHING
+"""
+
 @app.route('/add_calificacion', methods=['POST'])
 def add_calificacion():
     try:
@@ -634,81 +1472,157 @@ def add_calificacion():
         user_id = session.get('user_id')
         if not user_id:
             return redirect(url_for('login'))
-        db_query("INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)",
-                 (user_id, materia, calificacion), commit=True)
+        # Solo alta: la ruta es del propio estudiante, así que no puede pisar
+        # una calificación que ya guardó el docente (eso es _upsert_calificacion)
+        insertadas = db_query(INSERTAR_CALIFICACION_SQL, (user_id, materia, calificacion),
+                              commit=True, write_only=True)
+        if insertadas:
+            _invalidar_dashboard()
+        else:
+            flash('Ya hay una calificación registrada para esa materia.', 'danger')
         return redirect(url_for('ver_calificaciones'))
     except Exception as e:
-        print("Error al añadir calificación:", e)
+        app.logger.exception("Error al añadir calificación")
         return str(e), 500
 
 @app.route('/guardar-calificacion', methods=['POST'])
 def guardar_calificacion():
     alumno_id = request.form.get('alumno_id')
-    materia_id = request.form.get('materia_id')
-    calificacion = request.form.get('calificacion')
+    materias_ids = request.form.getlist('materia_id')
+    calificaciones = request.form.getlist('calificacion')
+    es_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
     try:
-        registro = db_query("SELECT id FROM calificaciones WHERE user_id = %s AND materia = %s",
-                            (alumno_id, materia_id), one=True)
-        if registro:
-            # registro es dict
-            registro_id = registro.get('id') if isinstance(registro, dict) else registro[0]
-            db_query("UPDATE calificaciones SET calificacion = %s WHERE id = %s", (calificacion, registro_id), commit=True)
-            mensaje = '🔄 Calificación actualizada con éxito.'
+        if len(materias_ids) > 1:
+            # varias materias en un envío: un solo INSERT ... VALUES en lote
+            guardadas = _upsert_calificaciones(alumno_id, materias_ids, calificaciones)
+            mensaje = f'✅ {guardadas} calificaciones guardadas con éxito.'
         else:
-            db_query("INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)",
-                     (alumno_id, materia_id, calificacion), commit=True)
-            mensaje = '✅ Calificación registrada con éxito.'
+            mensaje = _mensaje_upsert(_upsert_calificacion(
+                alumno_id, request.form.get('materia_id'), request.form.get('calificacion')))
 
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if es_ajax:
             return jsonify({'exito': True, 'mensaje': mensaje})
         return redirect(url_for('registrar_calificacion', mensaje=mensaje))
     except Exception as e:
         mensaje = f'⚠️ Error al guardar la calificación: {e}'
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if es_ajax:
             return jsonify({'exito': False, 'mensaje': mensaje})
         return redirect(url_for('registrar_calificacion', mensaje=mensaje))
 
 # --------------------------------------------------
 # Eliminar materia (AJAX)
 # --------------------------------------------------
+# las calificaciones se borran en el CTE; la FK se comprueba al final de la sentencia
+ELIMINAR_MATERIA_PG = '''
+    WITH c AS (DELETE FROM calificaciones WHERE materia = %s)
+    DELETE FROM materias WHERE id = %s
+'''
+
 @app.route('/eliminar_materia/<int:materia_id>', methods=['POST'])
 def eliminar_materia(materia_id):
     try:
-        # Borrar calificaciones relacionadas
-        db_query("DELETE FROM calificaciones WHERE materia = %s", (materia_id,), commit=True)
-
-        # Borrar la materia
-        db_query("DELETE FROM materias WHERE id = %s", (materia_id,), commit=True)
+        # Borrar calificaciones relacionadas y la materia en una sola transacción;
+        # en Postgres además en una sola sentencia (un round-trip)
+        if _usa_sqlite():
+            db_transaction([
+                ("DELETE FROM calificaciones WHERE materia = %s", (materia_id,)),
+                ("DELETE FROM materias WHERE id = %s", (materia_id,)),
+            ])
+        else:
+            db_query(ELIMINAR_MATERIA_PG, (materia_id, materia_id), commit=True, write_only=True)
+        _invalidar_materias()
+        _invalidar_dashboard()
 
         return jsonify({"success": True})
     except Exception as e:
-        print("❌ Error al eliminar materia:", e)
+        app.logger.exception("❌ Error al eliminar materia")
         return jsonify({"success": False, "error": str(e)})
 
 # --------------------------------------------------
 # Mostrar calificaciones (panel) - para usuario autenticado
 # --------------------------------------------------
+MOSTRAR_CALIFICACIONES_SQL = '''
+    SELECT c.calificacion, m.nombre AS materia_nombre, m.licenciatura, m.semestre,
+           e.nombre AS estudiante_nombre,
+           MAX(m.semestre) OVER () AS semestre_actual
+    FROM calificaciones c
+    JOIN materias m ON c.materia = m.id
+    JOIN estudiantes e ON c.user_id = e.id
+    WHERE c.user_id = %s
+'''
+
+# Prefetch especulativo: al abrir el historial, la consulta de /calificaciones
+# (el siguiente paso habitual del estudiante) se lanza en un hilo y se solapa
+# con el render. El resultado va a la caché con caducidad PREFETCH_TTL (nada
+# queda para siempre); la clave lleva la versión del dashboard, así que
+# cualquier escritura de calificaciones deja sin efecto lo adelantado. A lo
+# sumo 2 hilos (y 2 conexiones del pool) a la vez.
+PREFETCH_TTL = 30
+_prefetch_executor = ThreadPoolExecutor(max_workers=2)
+
+def _clave_prefetch(user_id):
+    return f"calif_prefetch_v{cache.get('dash_ver') or 0}_{user_id}"
+
+def _adelantar_calificaciones(clave, user_id):
+    filas = db_query(MOSTRAR_CALIFICACIONES_SQL, (user_id,), one=False) or []
+    with app.app_context():
+        cache.set(clave, filas, timeout=PREFETCH_TTL)
+
+def _prefetch_calificaciones(user_id):
+    _prefetch_executor.submit(_adelantar_calificaciones, _clave_prefetch(user_id), user_id)
+
+def _calificaciones_prefetch(user_id):
+    """Resultado adelantado para user_id, o None si no hay uno vigente."""
+    return cache.get(_clave_prefetch(user_id))
+
 @app.route('/calificaciones')
 def mostrar_calificaciones():
     user_id = session.get('user_id')
     if not user_id:
         return redirect(url_for('login'))
-    calificaciones = db_query('''
-        SELECT c.calificacion, m.nombre AS materia_nombre, m.licenciatura, m.semestre,
-               e.nombre AS estudiante_nombre, e.semestre AS estudiante_semestre
-        FROM calificaciones c
-        JOIN materias m ON c.materia = m.id
-        JOIN estudiantes e ON c.user_id = e.id
-        WHERE c.user_id = %s
-    ''', (user_id,), one=False) or []
-    # semestre_actual: tomar máximo de columna semestre (índice 'semestre')
-    semestre_actual = max([row.get('semestre') if isinstance(row, dict) else row[3] for row in calificaciones]) if calificaciones else None
-    return render_template('calificaciones.html', calificaciones=calificaciones, semestre_actual=semestre_actual)
+    calificaciones = _calificaciones_prefetch(user_id)
+    if calificaciones is None:
+        calificaciones = db_query_preparada(MOSTRAR_CALIFICACIONES_SQL, (user_id,)) or []
+    # semestre_actual (máximo, calculado en SQL) y nombre: iguales en todas las filas
+    primera = calificaciones[0] if calificaciones else {}
+    return render_template('calificaciones.html', calificaciones=calificaciones,
+                           estudiante_nombre=primera.get('estudiante_nombre'),
+                           semestre_actual=primera.get('semestre_actual'))
 
 # --------------------------------------------------
 # Registrar calificación (vista para docentes/admin)
 # --------------------------------------------------
+ALUMNOS_POR_PAGINA = 500
+
+# Listado de alumnos en el orden en que se agrupan (licenciatura → semestre).
+# Lo comparten /registrar-calificacion (por páginas, cacheado) y /alumnos
+# (completo, por streaming): misma sentencia y mismo índice ix_est_lic_sem.
+ALUMNOS_ORDENADOS_SQL = (
+    "SELECT id, nombre, matricula, licenciatura, semestre FROM estudiantes "
+    "ORDER BY licenciatura, semestre, nombre"
+)
+
+@cache.memoize(timeout=300)
+def _alumnos_agrupados(pagina=1):
+    """
+    Devuelve (alumnos, alumnos_agrupados[licenciatura][semestre]) de una página.
+    El orden lo da SQL, así que basta una pasada con groupby.
+    Se invalida con _invalidar_alumnos() en cada escritura de estudiantes.
+    """
+    alumnos = db_query(
+        ALUMNOS_ORDENADOS_SQL + " LIMIT %s OFFSET %s",
+        (ALUMNOS_POR_PAGINA, (pagina - 1) * ALUMNOS_POR_PAGINA), one=False) or []
+    alumnos_agrupados = {
+        lic: {sem: list(grupo) for sem, grupo in groupby(por_lic, key=itemgetter('semestre'))}
+        for lic, por_lic in groupby(alumnos, key=itemgetter('licenciatura'))
+    }
+    return alumnos, alumnos_agrupados
+
+def _invalidar_alumnos():
+    cache.delete_memoized(_alumnos_agrupados)
+    _subir_version('alumnos')
+
 @app.route('/registrar-calificacion', methods=['GET', 'POST'])
 def registrar_calificacion():
     if request.method == 'POST':
@@ -716,44 +1630,23 @@ def registrar_calificacion():
         materia_id = request.form.get('materia_id')
         calificacion = request.form.get('calificacion')
         try:
-            registro = db_query("SELECT id FROM calificaciones WHERE user_id = %s AND materia = %s",
-                                (alumno_id, materia_id), one=True)
-            if registro:
-                registro_id = registro.get('id') if isinstance(registro, dict) else registro[0]
-                db_query("UPDATE calificaciones SET calificacion = %s WHERE id = %s",
-                         (calificacion, registro_id), commit=True)
-                mensaje = '🔄 Calificación actualizada con éxito.'
-            else:
-                db_query("INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)",
-                         (alumno_id, materia_id, calificacion), commit=True)
-                mensaje = '✅ Calificación registrada con éxito.'
+            mensaje = _mensaje_upsert(_upsert_calificacion(alumno_id, materia_id, calificacion))
         except Exception as e:
             mensaje = f'⚠️ Error al guardar la calificación: {str(e)}'
         return redirect(url_for('registrar_calificacion', mensaje=mensaje))
 
     mensaje = request.args.get('mensaje')
-    alumnos_sql = db_query("SELECT * FROM estudiantes", one=False) or []
-    materias_sql = db_query("SELECT * FROM materias", one=False) or []
-
-    # convertir (ya devuelto como dicts por db_query)
-    alumnos = alumnos_sql
-    materias = materias_sql
-
-    alumnos_agrupados = {}
-    for alumno in alumnos:
-        lic = alumno.get('licenciatura')
-        sem = alumno.get('semestre')
-        alumnos_agrupados.setdefault(lic, {}).setdefault(sem, []).append(alumno)
-
-    for lic in alumnos_agrupados:
-        for sem in alumnos_agrupados[lic]:
-            alumnos_agrupados[lic][sem].sort(key=lambda x: x.get('nombre', ''))
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    alumnos, alumnos_agrupados = _alumnos_agrupados(pagina)
+    materias = _todas_materias()
 
     return render_template('registrar_calificacion.html',
                            alumnos=alumnos,
                            materias=materias,
                            mensaje=mensaje,
-                           alumnos_agrupados=alumnos_agrupados)
+                           alumnos_agrupados=alumnos_agrupados,
+                           pagina=pagina,
+                           hay_siguiente=len(alumnos) == ALUMNOS_POR_PAGINA)
 
 # --------------------------------------------------
 # Actualizar semestres alumnos (bulk)
@@ -774,42 +1667,72 @@ def actualizar_semestre_alumnos():
     if semestre_destino_int < 1:
         return "El semestre destino no puede ser menor que 1", 400
 
-    # Ejecutar actualización
-    db_query("UPDATE estudiantes SET semestre = %s WHERE licenciatura = %s AND semestre = %s",
-             (semestre_destino_int, licenciatura, semestre_actual_int), commit=True)
+    # Ejecutar actualización; RETURNING dice cuántos alumnos cambiaron
+    actualizados = db_query(
+        "UPDATE estudiantes SET semestre = %s WHERE licenciatura = %s AND semestre = %s RETURNING id",
+        (semestre_destino_int, licenciatura, semestre_actual_int), commit=True) or []
+    if not actualizados:
+        return jsonify({'mensaje': '0 alumnos actualizados'})
+    _invalidar_alumnos()
 
-    return jsonify({'mensaje': 'Semestres actualizados correctamente'})
+    return jsonify({'mensaje': f'{len(actualizados)} alumnos actualizados'})
 
 # --------------------------------------------------
 # Historial académico
 # --------------------------------------------------
+HISTORIAL_SQL = '''
+    SELECT m.licenciatura, m.semestre, m.nombre AS materia, c.calificacion,
+           ROUND(AVG(COALESCE(c.calificacion, 0)) OVER (PARTITION BY m.semestre), 1) AS promedio_semestre
+    FROM calificaciones c
+    JOIN materias m ON c.materia = m.id
+    WHERE c.user_id = %s
+    ORDER BY m.licenciatura, m.semestre, m.nombre
+'''
+
+NOMBRE_ESTUDIANTE_SQL = "SELECT nombre FROM estudiantes WHERE id = %s"
+
+_get_licenciatura = itemgetter('licenciatura')
+_get_semestre = itemgetter('semestre')
+# posiciones de las columnas de HISTORIAL_SQL (filas como tuplas)
+_HIST_LIC, _HIST_SEM, _HIST_MATERIA, _HIST_CALIF, _HIST_PROMEDIO = range(5)
+_hist_licenciatura = itemgetter(_HIST_LIC)
+_hist_semestre = itemgetter(_HIST_SEM)
+
+def _agrupar_historial(resultado):
+    """
+    Arma historial[licenciatura][semestre] = [{materia, calificacion}, ...] y
+    los promedios por semestre en una sola pasada: las filas ya vienen
+    ordenadas por licenciatura, semestre, materia desde SQL.
+    """
+    historial = {}
+    promedios_por_semestre = {}
+    for lic, filas_lic in groupby(resultado, _hist_licenciatura):
+        # cada (licenciatura, semestre) llega una sola vez: se asigna la
+        # lista ya construida en vez de crecerla con setdefault/append
+        historial[lic] = semestres = {}
+        for sem, filas_sem in groupby(filas_lic, _hist_semestre):
+            filas_sem = list(filas_sem)
+            sem = int(sem or 0)
+            semestres[sem] = [
+                {'materia': fila[_HIST_MATERIA], 'calificacion': fila[_HIST_CALIF]}
+                for fila in filas_sem
+            ]
+            # promedio ya calculado en SQL (igual en todas las filas del semestre):
+            # sin listas de calificaciones ni sumas/conteos en Python
+            promedios_por_semestre[sem] = filas_sem[0][_HIST_PROMEDIO]
+    return historial, promedios_por_semestre
+
 @app.route('/historial')
 def historial_academico():
     user_id = session.get('user_id')
     if not user_id:
         return redirect(url_for('login'))
 
-    resultado = db_query('''
-        SELECT m.licenciatura, m.semestre, m.nombre AS materia, c.calificacion
-        FROM calificaciones c
-        JOIN materias m ON c.materia = m.id
-        WHERE c.user_id = %s
-        ORDER BY m.licenciatura, m.semestre, m.nombre
-    ''', (user_id,), one=False) or []
+    if session.get('usuario_tipo') == 'estudiante':
+        _prefetch_calificaciones(user_id)
+    resultado = db_query_preparada(HISTORIAL_SQL, (user_id,), tuples=True) or []
 
-    historial = {}
-    promedios_por_semestre = {}
-    for fila in resultado:
-        lic = fila.get('licenciatura')
-        sem = int(fila.get('semestre') or 0)
-        historial.setdefault(lic, {}).setdefault(sem, []).append({
-            'materia': fila.get('materia'),
-            'calificacion': fila.get('calificacion')
-        })
-        promedios_por_semestre.setdefault(sem, []).append(fila.get('calificacion') or 0)
-
-    promedios_por_semestre = {sem: round(sum(califs) / len(califs), 1) if califs else 0
-                              for sem, califs in promedios_por_semestre.items()}
+    historial, promedios_por_semestre = _agrupar_historial(resultado)
 
     return render_template('historial_academico.html',
                            historial=historial,
@@ -817,34 +1740,17 @@ def historial_academico():
 
 @app.route('/ver_historial/<int:estudiante_id>')
 def ver_historial_estudiante(estudiante_id):
-    resultado = db_query('''
-        SELECT e.nombre AS estudiante, m.licenciatura, m.semestre, m.nombre AS materia, c.calificacion
-        FROM calificaciones c
-        JOIN materias m ON c.materia = m.id
-        JOIN estudiantes e ON c.user_id = e.id
-        WHERE c.user_id = %s
-        ORDER BY m.licenciatura, m.semestre, m.nombre
-    ''', (estudiante_id,), one=False) or []
+    resultado = db_query_preparada(HISTORIAL_SQL, (estudiante_id,), tuples=True) or []
 
     if not resultado:
         flash('Este estudiante aún no tiene calificaciones registradas.', 'warning')
         return redirect(url_for('alumnos'))
 
-    historial = {}
-    promedios_por_semestre = {}
-    for fila in resultado:
-        lic = fila.get('licenciatura')
-        sem = int(fila.get('semestre') or 0)
-        historial.setdefault(lic, {}).setdefault(sem, []).append({
-            'materia': fila.get('materia'),
-            'calificacion': fila.get('calificacion')
-        })
-        promedios_por_semestre.setdefault(sem, []).append(fila.get('calificacion') or 0)
-
-    promedios_por_semestre = {sem: round(sum(califs) / len(califs), 1) if califs else 0
-                              for sem, califs in promedios_por_semestre.items()}
-
-    nombre_estudiante = resultado[0].get('estudiante') if resultado else None
+    historial, promedios_por_semestre = _agrupar_historial(resultado)
+
+    # el nombre se pide una vez en vez de repetirlo en cada fila con un JOIN
+    estudiante = db_query_preparada(NOMBRE_ESTUDIANTE_SQL, (estudiante_id,), one=True)
+    nombre_estudiante = estudiante['nombre'] if estudiante else None
     return render_template('historial_academico.html',
                            estudiante=nombre_estudiante,
                            historial=historial,
@@ -853,6 +1759,20 @@ def ver_historial_estudiante(estudiante_id):
 # --------------------------------------------------
 # Update calificacion via form (buscar alumno por nombre/licenciatura/semestre)
 # --------------------------------------------------
+# Buscar al alumno y guardar la calificación en un solo statement
+# (WHERE true evita la ambigüedad de ON CONFLICT tras un SELECT en SQLite)
+GUARDAR_CALIFICACION_POR_NOMBRE_SQL = '''
+    WITH a AS (
+        SELECT id FROM estudiantes
+        WHERE nombre = %s AND licenciatura = %s AND semestre = %s
+        ORDER BY id LIMIT 1
+    )
+    INSERT INTO calificaciones (user_id, materia, calificacion)
+    SELECT a.id, %s, %s FROM a WHERE true
+    ON CONFLICT (user_id, materia) DO UPDATE SET calificacion = EXCLUDED.calificacion
+    RETURNING user_id
+'''
+
 @app.route('/update_calificacion', methods=['POST'])
 def update_calificacion():
     nombre_alumno = request.form.get('nombre_alumno')
@@ -861,20 +1781,12 @@ def update_calificacion():
     materia_id = request.form.get('materia_calificar')
     calificacion = request.form.get('calificacion')
 
-    alumno = db_query('SELECT id FROM estudiantes WHERE nombre = %s AND licenciatura = %s AND semestre = %s',
-                      (nombre_alumno, licenciatura, semestre), one=True)
-    if not alumno:
+    guardada = db_query(GUARDAR_CALIFICACION_POR_NOMBRE_SQL,
+                        (nombre_alumno, licenciatura, semestre, materia_id, calificacion),
+                        one=True, commit=True)
+    if not guardada:
         return "Alumno no encontrado", 404
-    alumno_id = alumno.get('id') if isinstance(alumno, dict) else alumno[0]
-
-    calificacion_existente = db_query('SELECT id FROM calificaciones WHERE user_id = %s AND materia = %s',
-                                     (alumno_id, materia_id), one=True)
-    if calificacion_existente:
-        cal_id = calificacion_existente.get('id') if isinstance(calificacion_existente, dict) else calificacion_existente[0]
-        db_query('UPDATE calificaciones SET calificacion = %s WHERE id = %s', (calificacion, cal_id), commit=True)
-    else:
-        db_query('INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)',
-                 (alumno_id, materia_id, calificacion), commit=True)
+    _invalidar_dashboard()
     return redirect(url_for('ver_calificaciones'))
 
 # --------------------------------------------------
@@ -882,13 +1794,27 @@ def update_calificacion():
 # --------------------------------------------------
 @app.route('/alumnos')
 def alumnos():
-    alumnos = db_query("SELECT * FROM estudiantes", one=False) or []
-    alumnos_por_licenciatura = {}
-    for alumno in alumnos:
-        lic = alumno.get('licenciatura')
-        sem = alumno.get('semestre')
-        alumnos_por_licenciatura.setdefault(lic, {}).setdefault(sem, []).append(alumno)
-    return render_template('alumnos.html', alumnos=alumnos_por_licenciatura)
+    return _respuesta_condicional('alumnos', _render_alumnos)
+
+def _render_alumnos():
+    # Se envía por partes: las filas llegan del cursor ya ordenadas y se
+    # agrupan sobre la marcha (licenciatura → semestre → alumnos) sin armar
+    # la lista completa en memoria
+    filas = db_query_iter(ALUMNOS_ORDENADOS_SQL)
+    alumnos_por_licenciatura = (
+        (lic, groupby(por_lic, _get_semestre))
+        for lic, por_lic in groupby(filas, _get_licenciatura)
+    )
+    return stream_template('alumnos.html', alumnos=alumnos_por_licenciatura)
+
+# Alta o actualización de alumno por matrícula (UNIQUE) en un solo round-trip
+UPSERT_ESTUDIANTE = """
+    INSERT INTO estudiantes (nombre, matricula, licenciatura, semestre) VALUES (%s, %s, %s, %s)
+    ON CONFLICT (matricula) DO UPDATE SET nombre = EXCLUDED.nombre,
+        licenciatura = EXCLUDED.licenciatura, semestre = EXCLUDED.semestre
+"""
+UPSERT_ESTUDIANTE_PG = UPSERT_ESTUDIANTE + " RETURNING (xmax = 0) AS inserted"
+UPSERT_ESTUDIANTE_SQLITE = UPSERT_ESTUDIANTE + " RETURNING NULL AS inserted"
 
 @app.route('/datos_alumnos', methods=['POST'])
 def datos_alumnos():
@@ -897,15 +1823,16 @@ def datos_alumnos():
     licenciatura = request.form.get('licenciatura')
     semestre = request.form.get('semestre')
 
-    alumno_existente = db_query("SELECT * FROM estudiantes WHERE matricula = %s", (matricula,), one=True)
-    if alumno_existente:
-        db_query('UPDATE estudiantes SET nombre = %s, licenciatura = %s, semestre = %s WHERE matricula = %s',
-                 (nombre, licenciatura, semestre, matricula), commit=True)
-        mensaje = f'🔄 Alumno actualizado al {semestre}° semestre.'
+    sql = UPSERT_ESTUDIANTE_SQLITE if _usa_sqlite() else UPSERT_ESTUDIANTE_PG
+    row = db_query(sql, (nombre, matricula, licenciatura, semestre), one=True, commit=True)
+    inserted = row.get('inserted') if row else None
+    if inserted is None:
+        mensaje = '✅ Alumno guardado correctamente.'
+    elif inserted:
+        mensaje = '✅ Alumno registrado correctamente.'
     else:
-        db_query('INSERT INTO estudiantes (nombre, matricula, licenciatura, semestre) VALUES (%s, %s, %s, %s)',
-                 (nombre, matricula, licenciatura, semestre), commit=True)
-        mensaje = f'✅ Alumno registrado correctamente.'
+        mensaje = f'🔄 Alumno actualizado al {semestre}° semestre.'
+    _invalidar_alumnos()
     return redirect(url_for('registrar_calificacion', mensaje=mensaje))
 
 @app.route('/delete_alumno', methods=['POST'])
@@ -913,20 +1840,19 @@ def delete_alumno():
     alumno_id = request.form.get('id')
 
     try:
-        # 1. Borrar todas las calificaciones asociadas al alumno
-        db_query("DELETE FROM calificaciones WHERE user_id = %s", (alumno_id,), commit=True)
-
-        # 2. Borrar calificaciones nuevas (si usas esta tabla)
-        db_query("DELETE FROM nuevas_calificaciones WHERE user_id = %s", (alumno_id,), commit=True)
-
-        # 3. Ahora sí eliminar al alumno
-        db_query("DELETE FROM estudiantes WHERE id = %s", (alumno_id,), commit=True)
+        # Calificaciones y alumno en una sola transacción
+        db_transaction([
+            ("DELETE FROM calificaciones WHERE user_id = %s", (alumno_id,)),
+            ("DELETE FROM estudiantes WHERE id = %s", (alumno_id,)),
+        ])
+        _invalidar_alumnos()
+        _invalidar_dashboard()
 
         flash("Alumno eliminado correctamente.")
         return redirect(url_for('alumnos'))
 
-    except Exception as e:
-        print("ERROR al eliminar alumno:", e)
+    except Exception:
+        app.logger.exception("ERROR al eliminar alumno")
         flash("❌ No se pudo eliminar el alumno. Revisa dependencias.")
         return redirect(url_for('registrar_calificacion'))
 
@@ -937,20 +1863,31 @@ def delete_alumno():
 def materias():
     # Permitir acceso a admin, docente y estudiante
     tipo = session.get('usuario_tipo')
-    if tipo not in ['admin', 'docente', 'estudiante']:
+    if tipo not in ROLES_CON_SESION:
         flash("Acceso restringido. Inicia sesión.")
         return redirect(url_for('index'))
 
-    materias_db = db_query("SELECT * FROM materias ORDER BY licenciatura, semestre, nombre")
-
-    materias_por_lic = {}
-    for m in materias_db:
-        lic = m.get('licenciatura')
-        sem = m.get('semestre')
-        materias_por_lic.setdefault(lic, {}).setdefault(sem, []).append(m)
+    # _todas_materias ya viene ordenada por licenciatura, semestre, nombre:
+    # basta agrupar consecutivos, sin setdefault por fila
+    materias_por_lic = {
+        lic: {sem: list(grupo) for sem, grupo in groupby(por_lic, _get_semestre)}
+        for lic, por_lic in groupby(_todas_materias(), _get_licenciatura)
+    }
 
     return render_template("materias.html", materias=materias_por_lic)
 
+# WHERE NOT EXISTS evita el duplicado en bases sin ux_materias_unica (las que
+# aún tienen materias repetidas); con el índice, ON CONFLICT DO NOTHING cubre
+# además dos altas simultáneas de la misma materia
+INSERTAR_MATERIA_SI_NUEVA_SQL = """
+    INSERT INTO materias (nombre, licenciatura, semestre)
+    SELECT %s, %s, CAST(%s AS INTEGER)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM materias WHERE nombre = %s AND licenciatura = %s AND semestre = %s
+    )
+    ON CONFLICT DO NOTHING
+"""
+
 @app.route('/add_materia', methods=['POST'])
 def add_materia():
     nombre = request.form.get('nombre')
@@ -961,62 +1898,93 @@ def add_materia():
         flash('Todos los campos son obligatorios', 'danger')
         return redirect(url_for('materias'))
 
-    # Validar duplicado
-    duplicado = db_query(
-        "SELECT 1 FROM materias WHERE nombre = %s AND licenciatura = %s AND semestre = %s",
-        (nombre, licenciatura, semestre),
-        one=True
+    # Insertar la materia solo si no está repetida: validación e INSERT en una
+    # sola sentencia (un round-trip, sin SELECT previo ni caché que consultar)
+    insertadas = db_query(
+        INSERTAR_MATERIA_SI_NUEVA_SQL,
+        (nombre, licenciatura, semestre, nombre, licenciatura, semestre),
+        commit=True, write_only=True
     )
 
-    if duplicado:
+    if not insertadas:
         flash('Esta materia ya existe en esa licenciatura y semestre.', 'warning')
         return redirect(url_for('materias'))
 
-    # Insertar la materia
-    db_query(
-        "INSERT INTO materias (nombre, licenciatura, semestre) VALUES (%s, %s, %s)",
-        (nombre, licenciatura, semestre),
-        commit=True
-    )
+    _invalidar_materias()
 
     flash('Materia añadida con éxito.', 'success')
     return redirect(url_for('materias'))
 
+# Materias repetidas (misma nombre/licenciatura/semestre) salvo la de menor id
+MATERIAS_DUPLICADAS_SQL = '''
+    WITH cte AS (
+        SELECT id, nombre, licenciatura, semestre,
+               ROW_NUMBER() OVER (PARTITION BY nombre, licenciatura, semestre ORDER BY id) AS rn
+        FROM materias
+    )
+    SELECT id, nombre, licenciatura, semestre FROM cte WHERE rn > 1
+'''
+
+@cache.memoize(300)
+def _materias_duplicadas():
+    # Se invalida con _invalidar_materias() junto con las listas de materias
+    return db_query(MATERIAS_DUPLICADAS_SQL, one=False) or []
+
 @app.route('/gestion_materias')
 def gestion_materias():
-    materias_duplicadas = db_query('''
-        SELECT id, nombre, licenciatura, semestre
-        FROM materias
-        WHERE id NOT IN (
-            SELECT MIN(id) FROM materias GROUP BY nombre, licenciatura, semestre
-        )
-    ''', one=False) or []
+    materias_duplicadas = _materias_duplicadas()
     return render_template('gestionar_materias.html', materias_duplicadas=materias_duplicadas)
 
 @app.route('/ver_materias')
 def ver_materias():
-    materias = db_query("SELECT * FROM materias ORDER BY licenciatura, semestre, nombre", one=False) or []
-    estructura = {}
-    for m in materias:
-        lic = m.get('licenciatura')
-        sem = str(m.get('semestre'))
-        estructura.setdefault(lic, {}).setdefault(sem, []).append(m)
-    for lic in estructura:
-        for s in range(1, 8):
-            estructura[lic].setdefault(str(s), [])
+    return _respuesta_condicional('materias', _render_ver_materias)
+
+def _render_ver_materias():
+    materias = _todas_materias()
+    estructura = {
+        lic: {str(sem): list(grupo) for sem, grupo in groupby(por_lic, _get_semestre)}
+        for lic, por_lic in groupby(materias, _get_licenciatura)
+    }
+    # los semestres sin materias los resuelve el template (semestres.get(..., []))
     return render_template('ver_materias.html', materias=estructura)
 
+@cache.memoize(timeout=300)
+def _fetch_materias(licenciatura, semestre):
+    """
+    JSON ya serializado de las materias de (licenciatura, semestre).
+    Se invalida con _invalidar_materias() al crear/eliminar materias.
+    """
+    # licenciatura/semestre ya están en materias (ix_materias_lic_sem): sin JOIN
+    # a licenciaturas_materias, que add_materia no llena y dejaba fuera las
+    # materias nuevas; las filas ya son dicts {id, nombre}
+    materias = db_query('''
+        SELECT id, nombre FROM materias
+        WHERE licenciatura = %s AND semestre = %s
+        ORDER BY nombre
+    ''', (licenciatura, semestre), one=False) or []
+    return app.json.dumps({'materias': materias})
+
+@cache.memoize(timeout=300)
+def _todas_materias():
+    # catálogo completo ordenado (registrar_calificacion, /materias, /ver_materias)
+    return db_query(
+        "SELECT id, nombre, licenciatura, semestre FROM materias "
+        "ORDER BY licenciatura, semestre, nombre", one=False) or []
+
+def _invalidar_materias():
+    cache.delete_memoized(_fetch_materias)
+    cache.delete_memoized(_todas_materias)
+    cache.delete_memoized(_materias_duplicadas)
+    _subir_version('materias')
+
 @app.route('/obtener_materias', methods=['GET'])
 def obtener_materias():
     licenciatura = request.args.get('licenciatura')
     semestre = request.args.get('semestre')
-    materias = db_query('''
-        SELECT m.id, m.nombre FROM materias m
-        JOIN licenciaturas_materias lm ON m.id = lm.materia_id
-        WHERE lm.licenciatura = %s AND lm.semestre = %s
-    ''', (licenciatura, semestre), one=False) or []
-    materias_list = [{'id': m.get('id'), 'nombre': m.get('nombre')} for m in materias]
-    return jsonify({'materias': materias_list})
+    # mismo ETag de versión que /ver_materias: el select de la UI revalida y
+    # recibe 304 hasta que se crea o elimina una materia
+    return _respuesta_condicional('materias', lambda: Response(
+        _fetch_materias(licenciatura, semestre), mimetype='application/json'))
 
 # --------------------------------------------------
 # Materias calificadas por usuario/licenciatura/semestre
@@ -1034,6 +2002,11 @@ def materias_calificadas():
         WHERE e.id = %s AND e.licenciatura = %s AND m.semestre = %s
         ORDER BY m.semestre
     ''', (user_id, licenciatura, semestre), one=False) or []
+    # para fetch/AJAX: las filas (ya dicts) van directo al proveedor orjson,
+    # sin pasar por la plantilla
+    if (request.args.get('format') == 'json'
+            or request.headers.get('X-Requested-With') == 'XMLHttpRequest'):
+        return jsonify(materias)
     return render_template('materias_calificadas.html', materias=materias, user_id=user_id)
 
 # --------------------------------------------------
@@ -1043,38 +2016,37 @@ def materias_calificadas():
 def editar_calificacion(calificacion_id):
     if request.method == 'POST':
         nueva_calificacion = request.form.get('calificacion')
-        db_query("UPDATE calificaciones SET calificacion = %s WHERE id = %s", (nueva_calificacion, calificacion_id), commit=True)
+        db_query("UPDATE calificaciones SET calificacion = %s WHERE id = %s", (nueva_calificacion, calificacion_id),
+                 commit=True, write_only=True)
+        _invalidar_dashboard()
         flash('Calificación actualizada correctamente.', 'success')
         user_id = request.form.get('user_id')
         return redirect(url_for('ver_calificaciones', user_id=user_id))
-    calificacion = db_query("SELECT * FROM calificaciones WHERE id = %s", (calificacion_id,), one=True)
+    calificacion = db_query("SELECT id, user_id, calificacion FROM calificaciones WHERE id = %s",
+                            (calificacion_id,), one=True)
     return render_template('editar_calificacion.html', calificacion=calificacion)
 
 # --------------------------------------------------
 # Eliminar duplicados en calificaciones
 # --------------------------------------------------
+# duplicados (rn > 1) ya con nombres de materia y alumno, en una sola consulta
+CALIFICACIONES_DUPLICADAS_SQL = '''
+    WITH cte AS (
+        SELECT id, user_id, materia, calificacion,
+               ROW_NUMBER() OVER (PARTITION BY user_id, materia ORDER BY id) AS rn
+        FROM calificaciones
+    )
+    SELECT c.id, c.calificacion, m.nombre AS materia_nombre, e.nombre AS estudiante_nombre
+    FROM cte c
+    JOIN materias m ON c.materia = m.id
+    JOIN estudiantes e ON c.user_id = e.id
+    WHERE c.rn > 1
+'''
+
 @app.route('/eliminar_duplicados', methods=['GET', 'POST'])
 def eliminar_duplicados():
     if request.method == 'GET':
-        ids_duplicados = db_query('''
-            WITH cte AS (
-                SELECT id, ROW_NUMBER() OVER (PARTITION BY user_id, materia ORDER BY id) AS rn
-                FROM calificaciones
-            )
-            SELECT id FROM cte WHERE rn > 1;
-        ''', one=False) or []
-        duplicados_ids = [r.get('id') for r in ids_duplicados]
-        calificaciones_duplicadas = []
-        if duplicados_ids:
-            # build placeholders automatically in db_query by passing tuple; db_query handles sqlite/psql placeholders
-            placeholders = ','.join(['%s'] * len(duplicados_ids))
-            calificaciones_duplicadas = db_query(f'''
-                SELECT c.id, c.calificacion, m.nombre AS materia_nombre, e.nombre AS estudiante_nombre
-                FROM calificaciones c
-                JOIN materias m ON c.materia = m.id
-                JOIN estudiantes e ON c.user_id = e.id
-                WHERE c.id IN ({placeholders})
-            ''', tuple(duplicados_ids), one=False) or []
+        calificaciones_duplicadas = db_query(CALIFICACIONES_DUPLICADAS_SQL, one=False) or []
         return render_template('eliminar_duplicados.html', calificaciones=calificaciones_duplicadas)
 
     # POST: eliminar seleccionados
@@ -1082,21 +2054,34 @@ def eliminar_duplicados():
     if not duplicados_ids:
         flash('No se seleccionó ninguna calificación para eliminar.', 'danger')
         return redirect(url_for('eliminar_duplicados'))
-    for id_ in duplicados_ids:
-        db_query("DELETE FROM calificaciones WHERE id = %s", (id_,), commit=True)
-    flash(f'Se eliminaron {len(duplicados_ids)} calificaciones duplicadas.', 'success')
+    ids = [int(id_) for id_ in duplicados_ids if id_.isdigit()]
+    eliminadas = 0
+    if ids:
+        eliminadas = _eliminar_por_ids('calificaciones', ids)
+    if eliminadas:
+        # si ya no quedan duplicados se crea el UNIQUE que el arranque no pudo crear
+        try:
+            _crear_indice_unico(_db(), INDICE_UNICO_CALIFICACIONES)
+        except Exception:
+            app.logger.exception("❌ Error creando %s", INDICE_UNICO_CALIFICACIONES)
+    _invalidar_dashboard()
+    flash(f'Se eliminaron {eliminadas} calificaciones duplicadas.', 'success')
     return redirect(url_for('eliminar_duplicados'))
 
 # --------------------------------------------------
 # Inicializar materias para alumno (helper)
 # --------------------------------------------------
 def inicializar_materias_para_alumno(alumno_id, licenciatura, semestre):
-    materias = db_query("SELECT id FROM materias WHERE licenciatura = %s AND semestre = %s",
-                       (licenciatura, semestre), one=False) or []
-    for materia in materias:
-        mid = materia.get('id')
-        db_query("INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (%s, %s, %s)",
-                 (alumno_id, mid, 0), commit=True)
+    # Un solo INSERT ... SELECT con todas las materias del semestre;
+    # devuelve cuántas calificaciones se crearon
+    creadas = db_query('''
+        INSERT INTO calificaciones (user_id, materia, calificacion)
+        SELECT %s, id, 0 FROM materias WHERE licenciatura = %s AND semestre = %s
+        ON CONFLICT (user_id, materia) DO NOTHING
+    ''', (alumno_id, licenciatura, semestre), commit=True, write_only=True)
+    if creadas:
+        _invalidar_dashboard()
+    return creadas
 
 # --------------------------------------------------
 # Gestión y eliminación de materias duplicadas (vista)
@@ -1105,17 +2090,14 @@ def inicializar_materias_para_alumno(alumno_id, licenciatura, semestre):
 def gestionar_materias_view():
     if request.method == 'POST':
         ids_para_eliminar = request.form.getlist('materias_eliminar')
-        for materia_id in ids_para_eliminar:
-            db_query("DELETE FROM materias WHERE id = %s", (materia_id,), commit=True)
-        flash('Las materias seleccionadas han sido eliminadas.', 'success')
+        ids = [int(id_) for id_ in ids_para_eliminar if id_.isdigit()]
+        eliminadas = 0
+        if ids:
+            eliminadas = _eliminar_por_ids('materias', ids)
+            _invalidar_materias()
+        flash(f'Se eliminaron {eliminadas} materias.', 'success')
         return redirect(url_for('gestionar_materias_view'))
-    materias_duplicadas = db_query('''
-        SELECT id, nombre, licenciatura, semestre
-        FROM materias
-        WHERE id NOT IN (
-            SELECT MIN(id) FROM materias GROUP BY nombre, licenciatura, semestre
-        )
-    ''', one=False) or []
+    materias_duplicadas = _materias_duplicadas()
     return render_template('gestionar_materias.html', materias_duplicadas=materias_duplicadas)
 
 # --------------------------------------------------
@@ -1125,21 +2107,15 @@ def gestionar_materias_view():
 def test_db():
     try:
         # solo como prueba, distinto para sqlite/psql
-        if _is_sqlite_conn(g.db_conn):
-            return {"conexion": "sqlite"}
-        else:
-            cur = g.db_conn.cursor()
-            cur.execute("SELECT current_database(), current_user;")
-            res = cur.fetchall()
-            cur.close()
-            return {"conexion": res}
+        if _is_sqlite_conn(_db()):
+            return jsonify({"conexion": "sqlite"})
+        res = db_query("SELECT current_database() AS base, current_user AS usuario", one=True)
+        return jsonify({"conexion": res})
     except Exception as e:
-        return {"error": str(e)}
+        return jsonify({"error": str(e)}), 500
 
 # --------------------------------------------------
 # Run app (solo si se ejecuta directamente)
 # --------------------------------------------------
 if __name__ == '__main__':
-    # inicializa tablas si no existen
-    inicializar_tablas_minimas()
     app.run(debug=True, host='0.0.0.0', port=int(os.getenv("PORT", 5000)))
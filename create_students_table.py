@@ -1,21 +0,0 @@
-import sqlite3
-
-def create_students_table():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS estudiantes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            licenciatura TEXT NOT NULL,
-            semestre INTEGER NOT NULL,
-            email TEXT NOT NULL
-        )
-    ''')
-
-    conn.commit()
-    conn.close()
-
-if __name__ == "__main__":
-    create_students_table()
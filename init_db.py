@@ -1,19 +1,42 @@
 import sqlite3
 
-def init_db():
-    conn = sqlite3.connect('database.db')
-    cursor = conn.cursor()
+ESTUDIANTES_SQL = '''
+    CREATE TABLE IF NOT EXISTS {tabla} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        nombre TEXT NOT NULL,
+        matricula TEXT NOT NULL,
+        licenciatura TEXT NOT NULL,
+        semestre INTEGER NOT NULL
+    )
+'''
+COLUMNAS_ESTUDIANTES = {'id', 'nombre', 'matricula', 'licenciatura', 'semestre'}
 
-    # Crear la tabla de estudiantes
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS estudiantes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            nombre TEXT NOT NULL,
-            matricula TEXT NOT NULL,
-            licenciatura TEXT NOT NULL,
-            semestre INTEGER NOT NULL
-        )
+def _reconstruir_estudiantes(cursor):
+    """
+    Bases creadas con el antiguo create_students_table.py: estudiantes con
+    email NOT NULL y sin matrícula, así que ningún alta de la app funciona.
+    SQLite no cambia columnas en el lugar: se crea la tabla nueva, se copian
+    los alumnos (matrícula provisional SIN-MATRICULA-<id> si no tenían) y se
+    reemplaza la vieja. Devuelve True si hubo que reconstruirla.
+    """
+    columnas = {fila[1] for fila in cursor.execute('PRAGMA table_info(estudiantes)')}
+    if columnas == COLUMNAS_ESTUDIANTES:
+        return False
+    matricula = 'matricula' if 'matricula' in columnas else 'NULL'
+    cursor.execute(ESTUDIANTES_SQL.format(tabla='estudiantes_nueva'))
+    cursor.execute(f'''
+        INSERT INTO estudiantes_nueva (id, nombre, matricula, licenciatura, semestre)
+        SELECT id, nombre, COALESCE({matricula}, 'SIN-MATRICULA-' || id), licenciatura, semestre
+        FROM estudiantes
     ''')
+    cursor.execute('DROP TABLE estudiantes')
+    cursor.execute('ALTER TABLE estudiantes_nueva RENAME TO estudiantes')
+    return True
+
+def _migracion_1(cursor):
+    # Crear la tabla de estudiantes (o dejar la antigua con el esquema actual)
+    cursor.execute(ESTUDIANTES_SQL.format(tabla='estudiantes'))
+    _reconstruir_estudiantes(cursor)
 
     # Crear la tabla de materias
     cursor.execute('''
@@ -48,6 +71,10 @@ def init_db():
         )
     ''')
 
+    # Datos de prueba solo en una base vacía (antes se repetían en cada corrida)
+    if cursor.execute('SELECT 1 FROM materias LIMIT 1').fetchone():
+        return
+
     # Insertar materias de prueba
     cursor.execute("INSERT INTO materias (nombre, licenciatura, semestre) VALUES ('Matemáticas I', 'Ingeniería Civil', 1)")
     cursor.execute("INSERT INTO materias (nombre, licenciatura, semestre) VALUES ('Física I', 'Ingeniería Civil', 1)")
@@ -58,9 +85,46 @@ def init_db():
     cursor.execute("INSERT INTO licenciaturas_materias (licenciatura, semestre, materia_id) VALUES ('Ingeniería Civil', 1, 2)")
     cursor.execute("INSERT INTO licenciaturas_materias (licenciatura, semestre, materia_id) VALUES ('Ingeniería Informática', 1, 3)")
 
-    conn.commit()
+def _migracion_2(cursor):
+    # Índices para los WHERE/JOIN frecuentes (mismos nombres que DDL_INDICES
+    # en app.py, para que inicializar_tablas_minimas no los duplique). Los
+    # UNIQUE son los que necesitan los ON CONFLICT (UPSERT) de la app.
+    for sentencia in (
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_calif_user_mat ON calificaciones(user_id, materia)',
+        'CREATE UNIQUE INDEX IF NOT EXISTS ux_est_matricula ON estudiantes(matricula)',
+        'CREATE INDEX IF NOT EXISTS ix_est_nombre_lic_sem ON estudiantes(nombre, licenciatura, semestre, id)',
+        'CREATE INDEX IF NOT EXISTS ix_lm_lic_sem ON licenciaturas_materias(licenciatura, semestre, materia_id)',
+        'CREATE INDEX IF NOT EXISTS ix_materias_lic_sem ON materias(licenciatura, semestre, nombre)',
+    ):
+        cursor.execute(sentencia)
+
+def _migracion_3(cursor):
+    # La versión 1 anterior solo agregaba matricula a la tabla antigua y dejaba
+    # email NOT NULL; al reconstruirla se pierden sus índices, se vuelven a crear
+    if _reconstruir_estudiantes(cursor):
+        _migracion_2(cursor)
+
+# Migraciones en orden: la i-ésima lleva el esquema de la versión i-1 a la i
+# (el número queda en PRAGMA user_version). Las nuevas se agregan al final.
+MIGRACIONES = (_migracion_1, _migracion_2, _migracion_3)
+
+def init_db():
+    conn = sqlite3.connect('database.db')
+    # WAL queda guardado en el archivo: toda conexión posterior lo usa y los
+    # commits no hacen fsync del journal (synchronous=NORMAL se pone por conexión)
+    conn.execute('PRAGMA journal_mode = WAL')
+    cursor = conn.cursor()
+
+    # Solo corren las migraciones que faltan; cada una se confirma junto con
+    # su número de versión, así que volver a correr el script no repite nada
+    version = cursor.execute('PRAGMA user_version').fetchone()[0]
+    for numero, migracion in enumerate(MIGRACIONES[version:], version + 1):
+        migracion(cursor)
+        cursor.execute(f'PRAGMA user_version = {numero}')
+        conn.commit()
+
     conn.close()
-    print("Base de datos inicializada correctamente con datos de prueba.")
+    print(f"Base de datos en la versión {max(version, len(MIGRACIONES))} del esquema.")
 
 if __name__ == "__main__":
     init_db()
@@ -0,0 +1,29 @@
+import os
+
+# sin DDL al importar: la prueba no toca la base de datos
+os.environ.setdefault("SKIP_DB_INIT", "1")
+
+from app import app  # noqa: E402
+
+
+def test_flash_sobrevive_el_redirect():
+    """
+    Un flash guardado en la sesión (tupla etiquetada por el serializador de
+    Flask) se lee bien en la siguiente petición con el proveedor JSON de la app.
+    """
+    app.config['TESTING'] = True
+    client = app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['_flashes'] = [('message', 'Credenciales incorrectas ❌')]
+
+    respuesta = client.get('/login/admin')
+
+    assert respuesta.status_code == 200
+    assert 'Credenciales incorrectas' in respuesta.get_data(as_text=True)
+
+
+def test_sesion_ida_y_vuelta():
+    serializador = app.session_interface.get_signing_serializer(app)
+    with app.app_context():
+        datos = serializador.loads(serializador.dumps({'_flashes': [('danger', 'x')]}))
+    assert datos['_flashes'] == [('danger', 'x')]
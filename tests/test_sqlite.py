@@ -0,0 +1,209 @@
+import os
+import sqlite3
+
+import pytest
+
+# sin DDL al importar: cada prueba crea su propia base en tmp_path
+os.environ.setdefault("SKIP_DB_INIT", "1")
+
+import app as app_module  # noqa: E402
+import init_db  # noqa: E402
+from app import app, cache, inicializar_tablas_minimas  # noqa: E402
+
+
+def _cerrar_sqlite():
+    # la conexión SQLite es por hilo y vive entre peticiones: se descarta
+    # para que la siguiente prueba abra el database.db de su tmp_path
+    conn = getattr(app_module._sqlite_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        del app_module._sqlite_local.conn
+
+
+@pytest.fixture
+def base(tmp_path, monkeypatch):
+    """
+    database.db vacío en tmp_path (nunca el del repositorio) y SQLite aunque
+    el .env tenga DATABASE_URL. Devuelve una conexión sqlite3 aparte para
+    preparar y revisar datos.
+    """
+    monkeypatch.setenv("DATABASE_URL", "")
+    monkeypatch.chdir(tmp_path)
+    _cerrar_sqlite()
+    cache.clear()
+    app.config['TESTING'] = True
+    conn = sqlite3.connect(tmp_path / "database.db")
+    yield conn
+    conn.close()
+    _cerrar_sqlite()
+
+
+def _inicializar():
+    with app.app_context():
+        inicializar_tablas_minimas(forzar=True)
+
+
+def _indices(conn):
+    return {fila[0] for fila in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def _flashes(client):
+    with client.session_transaction() as sesion:
+        return [mensaje for _, mensaje in sesion.get('_flashes', [])]
+
+
+def test_guardar_calificacion_actualiza_en_vez_de_duplicar(base):
+    _inicializar()
+    client = app.test_client()
+    client.post('/guardar-calificacion', data={'alumno_id': 1, 'materia_id': 7, 'calificacion': 60})
+    client.post('/guardar-calificacion', data={'alumno_id': 1, 'materia_id': 7, 'calificacion': 95})
+
+    assert base.execute("SELECT user_id, materia, calificacion FROM calificaciones").fetchall() == [(1, 7, 95)]
+
+
+def test_guardar_calificacion_en_lote(base):
+    _inicializar()
+    client = app.test_client()
+    client.post('/guardar-calificacion', data={'alumno_id': 1, 'materia_id': 7, 'calificacion': 50})
+    respuesta = client.post('/guardar-calificacion',
+                            data={'alumno_id': 1, 'materia_id': [7, 8], 'calificacion': [70, 80]},
+                            headers={'X-Requested-With': 'XMLHttpRequest'})
+
+    assert respuesta.get_json()['exito']
+    assert base.execute(
+        "SELECT materia, calificacion FROM calificaciones ORDER BY materia").fetchall() == [(7, 70), (8, 80)]
+
+
+def test_add_calificacion_no_pisa_la_existente(base):
+    _inicializar()
+    client = app.test_client()
+    with client.session_transaction() as sesion:
+        sesion['user_id'] = 3
+    client.post('/add_calificacion', data={'materia': 2, 'calificacion': 90})
+    client.post('/add_calificacion', data={'materia': 2, 'calificacion': 10})
+
+    assert base.execute("SELECT calificacion FROM calificaciones").fetchall() == [(90,)]
+    assert _flashes(client) == ['Ya hay una calificación registrada para esa materia.']
+
+
+def test_datos_alumnos_en_base_sin_unique_de_matricula(base):
+    # estudiantes creada antes de que matricula fuera UNIQUE
+    base.execute("""
+        CREATE TABLE estudiantes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT NOT NULL, matricula TEXT NOT NULL,
+            licenciatura TEXT NOT NULL, semestre INTEGER NOT NULL
+        )
+    """)
+    base.commit()
+    _inicializar()
+    assert 'ux_est_matricula' in _indices(base)
+
+    client = app.test_client()
+    datos = {'nombre': 'Ana', 'matricula': 'A01', 'licenciatura': 'Civil', 'semestre': 1}
+    assert client.post('/datos_alumnos', data=datos).status_code == 302
+    assert client.post('/datos_alumnos', data={**datos, 'semestre': 2}).status_code == 302
+
+    assert base.execute("SELECT matricula, semestre FROM estudiantes").fetchall() == [('A01', 2)]
+
+
+def test_duplicados_no_se_borran_al_arrancar(base):
+    base.execute("CREATE TABLE calificaciones (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                 "user_id INTEGER NOT NULL, materia INTEGER NOT NULL, calificacion INTEGER NOT NULL)")
+    base.executemany("INSERT INTO calificaciones (user_id, materia, calificacion) VALUES (?, ?, ?)",
+                     [(1, 1, 70), (1, 1, 80)])
+    base.commit()
+    _inicializar()
+
+    assert base.execute("SELECT COUNT(*) FROM calificaciones").fetchone() == (2,)
+    assert 'ux_calif_user_mat' not in _indices(base)
+
+    resultado = app.test_cli_runner().invoke(args=['initdb', '--dedupe'])
+
+    assert resultado.exit_code == 0
+    assert base.execute("SELECT id, calificacion FROM calificaciones").fetchall() == [(1, 70)]
+    assert 'ux_calif_user_mat' in _indices(base)
+
+
+def test_eliminar_por_ids(base):
+    _inicializar()
+    base.executemany("INSERT INTO materias (nombre, licenciatura, semestre) VALUES (?, 'Civil', 1)",
+                     [('A',), ('B',), ('C',)])
+    base.commit()
+
+    with app.app_context():
+        assert app_module._eliminar_por_ids('materias', [1, 3, 99]) == 2
+        with pytest.raises(KeyError):
+            app_module._eliminar_por_ids('estudiantes', [2])
+
+    assert base.execute("SELECT nombre FROM materias").fetchall() == [('B',)]
+
+
+def test_ver_materias_responde_304_hasta_que_cambian(base):
+    _inicializar()
+    client = app.test_client()
+    primera = client.get('/ver_materias')
+    etag = primera.headers['ETag']
+
+    assert primera.status_code == 200
+    assert client.get('/ver_materias', headers={'If-None-Match': etag}).status_code == 304
+
+    client.post('/add_materia', data={'nombre': 'Física', 'licenciatura': 'Civil', 'semestre': 1})
+    despues = client.get('/ver_materias', headers={'If-None-Match': etag})
+
+    assert despues.status_code == 200
+    assert despues.headers['ETag'] != etag
+
+
+def test_usuarios_paginados_por_keyset(base, monkeypatch):
+    _inicializar()
+    monkeypatch.setattr(app_module, 'USUARIOS_POR_PAGINA', 2)
+    base.executemany("INSERT INTO maestros (usuario, contrasena) VALUES (?, 'x')",
+                     [('d1',), ('d2',), ('d3',)])
+    base.execute("INSERT INTO administrativos (usuario, contrasena) VALUES ('a1', 'x')")
+    base.commit()
+
+    with app.app_context():
+        docentes, admins, sig_docente, sig_admin = app_module._usuarios_por_tipo()
+        assert [u['usuario'] for u in docentes] == ['d1', 'd2']
+        assert [u['usuario'] for u in admins] == ['a1']
+        assert (sig_docente, sig_admin) == ('d2', None)
+
+        docentes, _, sig_docente, _ = app_module._usuarios_por_tipo(sig_docente, 'a1')
+        assert [u['usuario'] for u in docentes] == ['d3']
+        assert sig_docente is None
+
+
+def _version_esquema(conn):
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def test_init_db_base_nueva_y_segunda_corrida(base):
+    init_db.init_db()
+    init_db.init_db()
+
+    assert _version_esquema(base) == len(init_db.MIGRACIONES)
+    assert {'ux_calif_user_mat', 'ux_est_matricula'} <= _indices(base)
+    # los datos de prueba se insertan una sola vez
+    assert base.execute("SELECT COUNT(*) FROM materias").fetchone() == (3,)
+    assert base.execute('PRAGMA journal_mode').fetchone() == ('wal',)
+
+
+def test_init_db_reconstruye_estudiantes_con_email(base):
+    # esquema del antiguo create_students_table.py
+    base.execute("""
+        CREATE TABLE estudiantes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, nombre TEXT NOT NULL, licenciatura TEXT NOT NULL,
+            semestre INTEGER NOT NULL, email TEXT NOT NULL
+        )
+    """)
+    base.execute("INSERT INTO estudiantes (nombre, licenciatura, semestre, email) "
+                 "VALUES ('Ana', 'Civil', 1, 'ana@x.mx')")
+    base.commit()
+
+    init_db.init_db()
+
+    columnas = {fila[1] for fila in base.execute('PRAGMA table_info(estudiantes)')}
+    assert columnas == init_db.COLUMNAS_ESTUDIANTES
+    assert base.execute("SELECT id, nombre, matricula FROM estudiantes").fetchall() == [
+        (1, 'Ana', 'SIN-MATRICULA-1')]
+    assert 'ux_est_matricula' in _indices(base)
@@ -0,0 +1,20 @@
+# wsgi.py
+"""
+Punto de entrada para gunicorn con workers gevent.
+El parcheo tiene que ocurrir antes de importar app (y con él psycopg2,
+threading, socket...), por eso vive en un módulo aparte:
+
+    gunicorn wsgi:app --worker-class gevent --worker-connections 16
+
+Con psycogreen cada cur.execute cede el control mientras espera a Postgres,
+así un worker atiende otras peticiones en vez de quedarse bloqueado.
+DB_POOL_MAX (20) debe cubrir --worker-connections más los 2 hilos del
+prefetch: cada greenlet con SQL toma su propia conexión del pool.
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+patch_psycopg()
+
+from app import app  # noqa: E402